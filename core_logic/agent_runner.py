@@ -1,20 +1,16 @@
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.agents import AgentExecutor, create_openai_functions_agent
-from langchain.memory import ConversationBufferMemory
-from tools import generate_sql_tool, execute_sql_tool
-from dotenv import load_dotenv
-import os
+from tools import generate_sql_tool, execute_sql_tool, bind_sql_tool
+from llm_gateway import gateway
 
-load_dotenv()
-google_api_key = os.getenv("GOOGLE_API")
-
-def build_agent():
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
-        google_api_key=google_api_key
-    )
-    tools = [generate_sql_tool, execute_sql_tool]
+def build_agent(with_memory=True, llm=None, connection_string=None):
+    # with_memory=False: the caller passes "chat_history" itself (per-session history in app.py)
+    # llm: any LangChain chat model; defaults to the gateway's shared (rate-limited) client
+    # connection_string: the only database the agent's SQL tool can reach (otherwise the model picks the URL)
+    # the agent packages are imported here, not at module load, to keep startup fast
+    from langchain.agents import AgentExecutor, create_openai_functions_agent
+    if llm is None:
+        llm = gateway.get_chat_model()
+    tools = [generate_sql_tool, bind_sql_tool(connection_string) if connection_string else execute_sql_tool]
     prompt = ChatPromptTemplate.from_messages([
         ("system", """
 You are a self-healing SQL generation agent who understands multiple languages, including Hindi and other Indian languages.
@@ -29,8 +25,15 @@ Be careful, thorough, and multilingual-aware.
         """),
         MessagesPlaceholder(variable_name="chat_history"),
         ("human", "{input}"),
-        ("ai", "{agent_scratchpad}")
+        # the function calls and results so far, as messages (not text in one AI turn)
+        MessagesPlaceholder(variable_name="agent_scratchpad")
     ])
+    # each agent step retries throttled/transient LLM errors with the gateway's jittered backoff.
+    # with_retry only covers invoke/batch, so the executor must not stream the agent
+    # (stream_runnable=False); the gateway's own client is built with retries off
+    agent = create_openai_functions_agent(llm=llm, tools=tools, prompt=prompt).with_retry(**gateway.retry_policy())
+    if not with_memory:
+        return AgentExecutor(agent=agent, tools=tools, stream_runnable=False)
+    from langchain.memory import ConversationBufferMemory
     memory = ConversationBufferMemory(return_messages=True, memory_key="chat_history")
-    agent = create_openai_functions_agent(llm=llm, tools=tools, prompt=prompt)
-    return AgentExecutor(agent=agent, tools=tools, memory=memory)
+    return AgentExecutor(agent=agent, tools=tools, memory=memory, stream_runnable=False)
@@ -0,0 +1,162 @@
+# answer_pipeline.py
+# The question -> SQL -> rows pipeline behind /chat (Flask and async), batch
+# runs and the CLI: question cache, the direct structured call (or the agent),
+# the cost guard, execution, and self-heal with the fix guarded again. It is
+# synchronous; the async app runs it in a worker thread and passes per-upstream
+# semaphores as `limits`, so a burst of questions cannot stampede one provider.
+import re
+from contextlib import contextmanager, nullcontext
+
+from direct_pipeline import use_direct, direct_sql, direct_output
+from llm_language_router import route_query
+from sql_repair import heal_sql
+from query_guard import guard_sql, is_safe_select, QueryTimeoutError
+from query_cache import question_cache
+from tools import run_sql
+import metrics
+
+
+@contextmanager
+def _stage(name, upstream, limits):
+    # timed for the request breakdown, including any wait for the upstream's limit
+    with metrics.span(name), (limits or {}).get(upstream) or nullcontext():
+        yield
+
+def extract_sql(agent_output):
+    # the agent leaves its SQL fenced in triple backticks (```sql ... ```)
+    match = re.search(r"```(?:sql)?\s*(.*?)```", str(agent_output), re.DOTALL | re.IGNORECASE)
+    return match.group(1).strip() if match else None
+
+def answer_question(tenant, question, history=None, english_query=None, limits=None):
+    """
+    Answer `question` against the tenant's database and return the /chat body.
+
+    history is the session's SessionHistory (None for a one-off question);
+    english_query skips translation when the caller already has it (batch runs);
+    limits maps "llm" / "embed" / "db" to context managers held around those calls.
+    When the SQL is not run (not a SELECT, or rejected by the cost guard) the body
+    has "executed": False and a "reason".
+    """
+    db_url = tenant.connection_string
+    fingerprint = tenant.fingerprint
+    # follow-ups depend on the conversation, so only fresh questions use the cache
+    use_cache = history is None or history.is_empty()
+
+    # exact repeat of an already answered question: skip translation and the agent
+    cache_status = None
+    cached = question_cache.get(question, fingerprint) if use_cache else None
+    if cached is None:
+        if english_query is None:
+            with _stage("translation", "llm", limits):
+                english_query = route_query(question)
+        if use_cache:
+            with _stage("similar_lookup", "embed", limits):
+                cached = question_cache.get_similar(english_query, fingerprint)
+            if cached is not None:
+                cache_status = "similar"
+    else:
+        cache_status = "exact"
+    metrics.incr("question_cache_lookups", result=cache_status or "miss")
+
+    pipeline = None
+    if cached is not None:
+        agent_output = cached["agent_output"]
+        sql_query = cached["sql"]
+        english_query = cached.get("english_question") or english_query or question
+    else:
+        with _stage("schema_retrieval", "embed", limits):
+            schema_context = "\n".join(tenant.index.search(english_query))
+
+        # fresh questions: one structured LLM call; the agent only if that defers
+        direct = None
+        if use_direct(history):
+            with _stage("direct_sql", "llm", limits):
+                direct = direct_sql(english_query, schema_context, db_url)
+        if direct is not None:
+            pipeline = "direct"
+            agent_output = direct_output(direct)
+            sql_query = direct.sql.strip()
+        else:
+            pipeline = "agent"
+            with _stage("agent", "llm", limits):
+                response = tenant.agent.invoke({
+                    "input": f"{english_query}\n\nSCHEMA CONTEXT:\n{schema_context}",
+                    "chat_history": history.messages() if history else []
+                }, config={"callbacks": metrics.callbacks()})
+            agent_output = response['output'] if isinstance(response, dict) and 'output' in response else response
+            sql_query = extract_sql(agent_output)
+        metrics.incr("pipeline", mode=pipeline)
+    # every answered turn goes into the session, cache hits included, so the
+    # next question is treated (and resolved) as a follow-up
+    if history is not None:
+        history.add_turn(english_query, agent_output or sql_query)
+
+    body = {
+        "agent_output": agent_output,
+        "english_question": english_query,
+        "sql": sql_query,
+        "rows": None,
+        "error": None,
+        "gemini_suggestion": None,
+        "fix_result": None,
+        # which repair tier ("local" / "llm") produced the fix, LLM rounds and time spent
+        "heal": None,
+        "cache": cache_status,
+        "database": tenant.name,
+        # "direct" (single structured call) or "agent"; None when answered from the cache
+        "pipeline": pipeline,
+        # cost guard verdict: "allowed" / "limited" (LIMIT injected) plus reasons, timeout flag
+        "guard": None
+    }
+    if not sql_query:
+        return body
+    if not is_safe_select(sql_query):
+        return dict(body, executed=False, reason="Only SELECT queries are allowed to be executed automatically.")
+
+    # cost guard: reject cartesian joins, cap full scans of large tables with a LIMIT
+    with _stage("query_guard", "db", limits):
+        guard = guard_sql(db_url, sql_query)
+    metrics.incr("query_guard", action=guard["action"])
+    body["guard"] = guard
+    if guard["action"] == "rejected":
+        return dict(body, executed=False, reason="Query rejected by the cost guard: " + "; ".join(guard["reasons"]))
+    body["sql"] = sql_query = guard["sql"]
+    try:
+        with _stage("sql_execution", "db", limits):
+            body["rows"] = run_sql(db_url, sql_query)
+        if cached is None and use_cache:
+            question_cache.put(question, fingerprint, sql_query, agent_output, english_query)
+    except QueryTimeoutError as e:
+        # the SQL is valid, just too expensive: nothing for self-heal to fix
+        body["error"] = str(e)
+        guard["timed_out"] = True
+        metrics.incr("query_timeouts")
+    except Exception as e:
+        error_msg = str(e)
+        # self-healing flow: local identifier repair first, then vector memory + LLM rounds
+        with _stage("self_heal", "llm", limits):
+            heal = heal_sql(db_url, tenant.schema, tenant.schema_text, sql_query, error_msg, english_query,
+                            is_safe=is_safe_select)
+        metrics.incr("self_heal", tier=heal["tier"] or "failed")
+        body["heal"] = {k: heal[k] for k in ("tier", "rounds", "elapsed_ms")}
+        body["gemini_suggestion"] = heal["sql"] or heal["suggestion"]
+        heal_guard = None
+        if heal["sql"]:
+            with _stage("query_guard", "db", limits):
+                heal_guard = guard_sql(db_url, heal["sql"])
+        if heal_guard and heal_guard["action"] == "rejected":
+            error_msg = f"{error_msg}; fix_attempt_error: rejected by the cost guard: " + "; ".join(heal_guard["reasons"])
+        elif heal_guard:
+            body["gemini_suggestion"] = heal_guard["sql"]
+            try:
+                with _stage("sql_execution", "db", limits):
+                    body["fix_result"] = run_sql(db_url, heal_guard["sql"])
+                if use_cache:
+                    question_cache.put(question, fingerprint, heal_guard["sql"], agent_output, english_query)
+            except Exception as inner_e:
+                # keep both errors
+                error_msg = f"{error_msg}; fix_attempt_error: {inner_e}"
+        else:
+            error_msg = f"{error_msg}; fix_attempt_error: {heal['error']}"
+        body["error"] = error_msg
+    return body
@@ -1,149 +1,236 @@
 # app.py
 import os
-import re
+import json
+import base64
+import hashlib
+import hmac
 import logging
-from flask import Flask, request, jsonify
+import secrets
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 
 # your modules (same names as in your script)
-from schema_extractor import extract_schema, render_schema_text
-from vector_store import create_schema_store, query_schema_store
-from agent_runner import build_agent
-from llm_language_router import route_query
-from self_healing_vector_db import store_error_pattern, search_similar_errors, prompt_gemini_with_error
-from tools import execute_sql_tool  # your existing executor; fallback below if missing
-
-# Optional helper: use sqlalchemy fallback if execute_sql_tool is not available
-def sqlalchemy_execute(db_url, query):
-    from sqlalchemy import create_engine, text
-    engine = create_engine(db_url, connect_args={"check_same_thread": False} if db_url.startswith("sqlite") else {})
-    with engine.connect() as conn:
-        res = conn.execute(text(query))
-        rows = [dict(r) for r in res]
-    return rows
-
-# simple safety check (use sqlparse for robust parsing)
-def is_safe_select(sql_text: str) -> bool:
-    s = sql_text.strip().lower()
-    # quick guard: allow only statements that start with SELECT
-    return s.startswith("select")
-
-# globals to hold heavy objects
-initialized = False
-schema_text = ""
-collection = None
-agent = None
-chunks = []
+from answer_pipeline import answer_question
+from query_guard import is_safe_select
+from tools import iter_rows, RESULT_ROW_CAP
+from db_engine import pool_stats
+from query_cache import question_cache
+from session_memory import session_store
+from embeddings import embedding_stats
+from llm_language_router import translation_cache
+from result_cache import result_cache
+from tenants import TenantRegistry, UnknownTenantError, configured_databases, DEFAULT_TENANT
+import metrics
+
+# signs /results cursors; set it when several processes must accept each other's cursors
+# (otherwise a random per-process key: cursors stop working after a restart)
+RESULTS_CURSOR_SECRET = (os.getenv("RESULTS_CURSOR_SECRET") or secrets.token_hex(32)).encode("utf-8")
+
+# pagination cursor for /results: the (already guarded) query, its database and where the
+# next page starts, HMAC-signed so only cursors issued by /chat can be replayed
+def encode_cursor(sql_text, offset, database=None):
+    raw = json.dumps({"sql": sql_text, "offset": offset, "database": database}).encode("utf-8")
+    body = base64.urlsafe_b64encode(raw).decode("ascii")
+    signature = hmac.new(RESULTS_CURSOR_SECRET, body.encode("ascii"), hashlib.sha256).hexdigest()
+    return f"{body}.{signature}"
+
+def decode_cursor(cursor):
+    body, _, signature = cursor.rpartition(".")
+    expected = hmac.new(RESULTS_CURSOR_SECRET, body.encode("ascii"), hashlib.sha256).hexdigest()
+    if not body or not hmac.compare_digest(signature, expected):
+        raise ValueError("cursor signature mismatch")
+    data = json.loads(base64.urlsafe_b64decode(body.encode("ascii")))
+    return data["sql"], int(data["offset"]), data.get("database")
 
 CONNECTION_STRING = os.getenv("DATABASE_URL", "sqlite:///example.db")
+# start the default database's warm-up from create_app; off = its first /chat (or /ready poll) triggers it
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1").lower() not in ("0", "false", "no")
+# how long /chat waits for an unfinished warm-up before answering 503
+WARMUP_WAIT_SECONDS = float(os.getenv("WARMUP_WAIT_SECONDS", "30"))
+
+# every database this process serves (DATABASE_URL is "default"); each is loaded on first use
+registry = TenantRegistry(configured_databases(CONNECTION_STRING))
 
 def create_app():
     app = Flask(__name__)
     CORS(app)
     logging.basicConfig(level=logging.INFO)
 
-    @app.before_request
-    def startup():
-        global initialized, schema_text, collection, agent, chunks
-        if initialized:
-            return
-        app.logger.info("Initializing schema and agent...")
-        schema = extract_schema(CONNECTION_STRING)
-        schema_text = render_schema_text(schema)
-        chunks = schema_text.split("\n\n")
-        collection = create_schema_store(chunks)
-        agent = build_agent()
-        initialized = True
-        app.logger.info("Initialization complete.")
+    if WARMUP_ON_START:
+        app.logger.info("Starting background warm-up...")
+        registry.get().warmup.start()
 
+    # liveness: the process is up and serving, regardless of warm-up state
     @app.route("/health", methods=["GET"])
     def health():
         return jsonify({"status": "ok"})
 
+    # readiness: 200 once schema, vector store and agent are loaded (?database=<name>, default database
+    # otherwise). Polling starts (or retries) the load of the default database or of one already resident;
+    # other databases are reported as not loaded rather than loaded by a probe, which could evict idle ones.
+    @app.route("/ready", methods=["GET"])
+    def ready():
+        database = request.args.get("database")
+        try:
+            tenant = registry.get() if not database or database == DEFAULT_TENANT else registry.peek(database)
+        except UnknownTenantError as e:
+            return jsonify({"error": "unknown_database", "database": e.args[0]}), 404
+        if tenant is None:
+            return jsonify({"ready": False, "loaded": False}), 503
+        status = dict(tenant.warmup.start().status(), loaded=True)
+        return jsonify(status), 200 if status["ready"] else 503
+
+    metrics.register_collector("question_cache", question_cache.stats)
+    metrics.register_collector("embedding_cache", embedding_stats)
+    metrics.register_collector("translation_cache", translation_cache.stats)
+    metrics.register_collector("result_cache", result_cache.stats)
+    metrics.register_collector("schema_index", lambda: {t.name: dict(t.index.stats) for t in registry.loaded() if t.index})
+    metrics.register_collector("tenants", registry.stats)
+    metrics.register_collector("sessions", session_store.stats)
+    metrics.register_collector("db_pool", pool_stats)
+
+    # {"question", "session_id"?, "database"?}: database picks the tenant, the default one if omitted
     @app.route("/chat", methods=["POST"])
     def chat():
+        data = request.get_json(force=True) or {}
+        try:
+            with registry.use(data.get("database")) as tenant:
+                if not tenant.warmup.wait(WARMUP_WAIT_SECONDS):
+                    return jsonify({"error": "warming_up", "warmup": tenant.warmup.status()}), 503
+                request_metrics, token = metrics.begin_request(data.get("request_id") or request.headers.get("X-Request-ID"))
+                try:
+                    body, status = _chat(data, tenant)
+                finally:
+                    breakdown = metrics.end_request(request_metrics, token)
+        except UnknownTenantError as e:
+            return jsonify({"error": "unknown_database", "database": e.args[0]}), 404
+        body["request_id"] = breakdown["request_id"]
+        # opt-in per-request stage breakdown
+        if data.get("timings") or request.args.get("timings"):
+            body["timings"] = breakdown
+        return jsonify(body), status
+
+    def _chat(data, tenant):
         try:
-            data = request.get_json(force=True)
             question = data.get("question") or ""
             if not question:
-                return jsonify({"error": "missing 'question' field"}), 400
-
-            english_query = route_query(question)
-            top_chunks = query_schema_store(collection, english_query)
-            schema_context = "\n".join(top_chunks)
-
-            full_input = f"{english_query}\n\nSCHEMA CONTEXT:\n{schema_context}"
-
-            # call agent
-            response = agent.invoke({"input": full_input})
-            agent_output = response['output'] if isinstance(response, dict) and 'output' in response else response
-
-            # try to capture SQL fenced in triple backticks (```sql ... ```)
-            sql_match = re.search(r"```(?:sql)?\s*(.*?)```", str(agent_output), re.DOTALL | re.IGNORECASE)
-            sql_query = sql_match.group(1).strip() if sql_match else None
-
-            result_rows = None
-            error_msg = None
-            gemini_suggestion = None
-            fix_result = None
-
-            if sql_query:
-                # safety check
-                if not is_safe_select(sql_query):
-                    return jsonify({
-                        "agent_output": agent_output,
-                        "sql": sql_query,
-                        "executed": False,
-                        "reason": "Only SELECT queries are allowed to be executed automatically."
-                    }), 200
-
-                db_url = os.getenv("DATABASE_URL", CONNECTION_STRING)
-                try:
-                    # try your execute_sql_tool first; otherwise fallback
-                    try:
-                        result_rows = execute_sql_tool(db_url, sql_query)
-                    except NameError:
-                        result_rows = sqlalchemy_execute(db_url, sql_query)
-                except Exception as e:
-                    error_msg = str(e)
-                    # self-healing flow
-                    sim_errors = search_similar_errors(schema_text, sql_query, error_msg, english_query)
-                    best_case = sim_errors[0]['meta'] if sim_errors else None
-                    gemini_suggestion = prompt_gemini_with_error(schema_text, sql_query, error_msg, english_query, best_case)
-                    # attempt suggested fix only if safe
-                    if gemini_suggestion and is_safe_select(gemini_suggestion):
-                        try:
-                            try:
-                                fix_result = execute_sql_tool(db_url, gemini_suggestion)
-                            except NameError:
-                                fix_result = sqlalchemy_execute(db_url, gemini_suggestion)
-                            # store pattern so future errors can be fixed automatically
-                            store_error_pattern(schema_text, sql_query, error_msg, english_query, gemini_suggestion)
-                        except Exception as inner_e:
-                            # keep both errors
-                            error_msg = f"{error_msg}; fix_attempt_error: {inner_e}"
-
-            return jsonify({
-                "agent_output": agent_output,
-                "sql": sql_query,
-                "rows": result_rows,
-                "error": error_msg,
-                "gemini_suggestion": gemini_suggestion,
-                "fix_result": fix_result
-            }), 200
+                return {"error": "missing 'question' field"}, 400
+
+            # no session_id -> a stateless one-off question
+            body = answer_question(tenant, question, tenant.session(data.get("session_id")))
+            if body.get("executed") is False:
+                return body, 200
+            executed_sql = body["gemini_suggestion"] if body["fix_result"] is not None else body["sql"]
+            # full result set, streamed page by page from /results
+            body["results_cursor"] = (encode_cursor(executed_sql, 0, tenant.name)
+                                      if body["rows"] is not None or body["fix_result"] is not None else None)
+            return body, 200
         except Exception as e:
             app.logger.exception("Unhandled error in /chat")
-            return jsonify({"error": "internal_server_error", "detail": str(e)}), 500
+            return {"error": "internal_server_error", "detail": str(e)}, 500
 
     # optional: endpoint to reload schema (admin only — add auth in prod)
     @app.route("/reload-schema", methods=["POST"])
     def reload_schema():
-        global schema_text, collection, agent, chunks
-        schema = extract_schema(CONNECTION_STRING)
-        schema_text = render_schema_text(schema)
-        chunks = schema_text.split("\n\n")
-        collection = create_schema_store(chunks)
-        return jsonify({"status": "schema reloaded"}), 200
+        data = request.get_json(silent=True) or {}
+        try:
+            with registry.use(data.get("database") or request.args.get("database")) as tenant:
+                if not tenant.warmup.wait(WARMUP_WAIT_SECONDS):
+                    return jsonify({"error": "warming_up", "warmup": tenant.warmup.status()}), 503
+                tenant.reload()
+        except UnknownTenantError as e:
+            return jsonify({"error": "unknown_database", "database": e.args[0]}), 404
+        return jsonify({"status": "schema reloaded", "database": tenant.name}), 200
+
+    # stream a result set as NDJSON: a {"columns": [...]} line, one JSON array per row,
+    # then a {"next_cursor": ..., "row_count": n} line (next_cursor is null on the last page).
+    # Only cursors issued by /chat (results_cursor) are accepted, never raw SQL.
+    @app.route("/results", methods=["GET", "POST"])
+    def results():
+        data = request.get_json(silent=True) or {}
+        cursor = data.get("cursor") or request.args.get("cursor")
+        if not cursor:
+            return jsonify({"error": "missing 'cursor' (results_cursor from /chat)"}), 400
+        try:
+            page_size = int(data.get("page_size") or request.args.get("page_size") or 1000)
+            sql_query, offset, database = decode_cursor(cursor)
+        except (ValueError, KeyError, TypeError, UnicodeError):
+            return jsonify({"error": "invalid cursor or page_size"}), 400
+        if not sql_query or not is_safe_select(sql_query):
+            return jsonify({"error": "Only SELECT queries can be streamed."}), 400
+        page_size = max(1, min(page_size, RESULT_ROW_CAP))
+        try:
+            # paging needs only the engine, not the tenant's schema store or agent
+            db_url = registry.url(database)
+        except UnknownTenantError as e:
+            return jsonify({"error": "unknown_database", "database": e.args[0]}), 404
+
+        def generate():
+            # fetch one extra row to learn whether another page exists
+            rows = iter_rows(db_url, sql_query, offset=offset, limit=page_size + 1)
+            yield json.dumps({"columns": next(rows)}) + "\n"
+            count = 0
+            has_more = False
+            for row in rows:
+                if count == page_size:
+                    has_more = True
+                    break
+                count += 1
+                yield json.dumps(list(row), default=str) + "\n"
+            rows.close()
+            next_cursor = encode_cursor(sql_query, offset + count, database) if has_more else None
+            yield json.dumps({"next_cursor": next_cursor, "row_count": count}) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    # answer many questions at once: {"questions": [str | {"id", "question"}], "workers": n, "database"?};
+    # streams one NDJSON line per question as it finishes
+    @app.route("/batch", methods=["POST"])
+    def batch():
+        from batch import iter_batch, BATCH_WORKERS
+        data = request.get_json(force=True) or {}
+        database = data.get("database")
+        try:
+            tenant = registry.get(database)
+        except UnknownTenantError as e:
+            return jsonify({"error": "unknown_database", "database": e.args[0]}), 404
+        items = data.get("questions")
+        if not isinstance(items, list):
+            return jsonify({"error": "missing 'questions' list"}), 400
+        records = []
+        for i, item in enumerate(items, 1):
+            if isinstance(item, dict):
+                item_id, question = item.get("id", i), item.get("question") or ""
+            else:
+                item_id, question = i, item
+            if not isinstance(question, str):
+                return jsonify({"error": f"questions[{i - 1}] must be a string or an object with a string 'question'"}), 400
+            records.append((str(item_id), question))
+        try:
+            workers = max(1, min(int(data.get("workers") or BATCH_WORKERS), BATCH_WORKERS))
+        except (TypeError, ValueError):
+            return jsonify({"error": "'workers' must be an integer"}), 400
+        if not tenant.warmup.wait(WARMUP_WAIT_SECONDS):
+            return jsonify({"error": "warming_up", "warmup": tenant.warmup.status()}), 503
+
+        def generate():
+            # pinned for the whole stream so the tenant is not evicted mid-batch
+            with registry.use(database) as pinned:
+                if not pinned.warmup.wait(WARMUP_WAIT_SECONDS):
+                    yield json.dumps({"error": "warming_up", "warmup": pinned.warmup.status()}) + "\n"
+                    return
+                for result in iter_batch(records, pinned, workers):
+                    yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    @app.route("/metrics", methods=["GET"])
+    def prometheus_metrics():
+        return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/pool-stats", methods=["GET"])
+    def get_pool_stats():
+        return jsonify(pool_stats()), 200
 
     return app
 
@@ -0,0 +1,122 @@
+# async_app.py
+# Async serving mode for the /chat pipeline (Quart, the asyncio twin of Flask).
+# Each question runs the shared synchronous pipeline (answer_pipeline) in a
+# worker thread, and its LLM, embedding and database calls wait on a
+# per-upstream semaphore, so one process can hold many questions in flight
+# while they wait on Gemini, the embedding API or the database.
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, request, jsonify
+from quart_cors import cors
+
+from answer_pipeline import answer_question
+from tenants import TenantRegistry, UnknownTenantError, configured_databases, DEFAULT_TENANT
+
+# bounded concurrency per upstream so a burst of questions cannot stampede one provider
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "16"))
+DB_CONCURRENCY = int(os.getenv("DB_CONCURRENCY", "10"))
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1").lower() not in ("0", "false", "no")
+# how long /chat waits for an unfinished warm-up before answering 503
+WARMUP_WAIT_SECONDS = float(os.getenv("WARMUP_WAIT_SECONDS", "30"))
+CONNECTION_STRING = os.getenv("DATABASE_URL", "sqlite:///example.db")
+
+# per-upstream limits, shared by every database; the pipeline runs in worker
+# threads, so these are thread semaphores held around each upstream call
+UPSTREAM_LIMITS = {
+    "llm": threading.BoundedSemaphore(LLM_CONCURRENCY),
+    "embed": threading.BoundedSemaphore(EMBED_CONCURRENCY),
+    "db": threading.BoundedSemaphore(DB_CONCURRENCY)
+}
+_sized_loop = None
+
+async def run(fn, *args, **kwargs):
+    global _sized_loop
+    loop = asyncio.get_running_loop()
+    if _sized_loop is not loop:
+        # asyncio.to_thread uses the loop's default executor, min(32, cpus + 4) threads, and a
+        # question holds its thread for the whole pipeline: on a small host that is fewer
+        # questions in flight than the limits admit, so size it to their sum
+        loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=LLM_CONCURRENCY + EMBED_CONCURRENCY + DB_CONCURRENCY, thread_name_prefix="pipeline"))
+        _sized_loop = loop
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+async def answer(tenant, question, session_id=None):
+    # the same synchronous pipeline as the Flask app, in a worker thread
+    return await run(answer_question, tenant, question, tenant.session(session_id), limits=UPSTREAM_LIMITS)
+
+
+def create_async_app(connection_string=CONNECTION_STRING):
+    app = cors(Quart(__name__))
+    logging.basicConfig(level=logging.INFO)
+    # connection_string is the default database; TENANT_DATABASES adds the others
+    registry = TenantRegistry(configured_databases(connection_string))
+    app.config["TENANTS"] = registry
+
+    @app.before_serving
+    async def start_warmup():
+        if not WARMUP_ON_START:
+            return
+        # don't block startup: the tenant loads on its own warm-up thread
+        registry.get().warmup.start()
+
+    # liveness: the process is up and serving, regardless of warm-up state
+    @app.route("/health", methods=["GET"])
+    async def health():
+        return jsonify({"status": "ok"})
+
+    # readiness: 200 once schema, vector store and agent are loaded (?database=<name>, default database
+    # otherwise). Polling starts (or retries) the load of the default database or of one already resident;
+    # other databases are reported as not loaded rather than loaded by a probe, which could evict idle ones.
+    @app.route("/ready", methods=["GET"])
+    async def ready():
+        database = request.args.get("database")
+        try:
+            tenant = registry.get() if not database or database == DEFAULT_TENANT else registry.peek(database)
+        except UnknownTenantError as e:
+            return jsonify({"error": "unknown_database", "database": e.args[0]}), 404
+        if tenant is None:
+            return jsonify({"ready": False, "loaded": False}), 503
+        status = dict(tenant.warmup.start().status(), loaded=True)
+        return jsonify(status), 200 if status["ready"] else 503
+
+    # {"question", "session_id"?, "database"?}: database picks the tenant, the default one if omitted
+    @app.route("/chat", methods=["POST"])
+    async def chat():
+        try:
+            data = await request.get_json(force=True)
+            question = (data or {}).get("question") or ""
+            if not question:
+                return jsonify({"error": "missing 'question' field"}), 400
+            with registry.use(data.get("database")) as tenant:
+                if not await run(tenant.warmup.wait, WARMUP_WAIT_SECONDS):
+                    return jsonify({"error": "warming_up", "warmup": tenant.warmup.status()}), 503
+                return jsonify(await answer(tenant, question, data.get("session_id"))), 200
+        except UnknownTenantError as e:
+            return jsonify({"error": "unknown_database", "database": e.args[0]}), 404
+        except Exception as e:
+            app.logger.exception("Unhandled error in /chat")
+            return jsonify({"error": "internal_server_error", "detail": str(e)}), 500
+
+    @app.route("/reload-schema", methods=["POST"])
+    async def reload_schema():
+        data = await request.get_json(silent=True) or {}
+        try:
+            with registry.use(data.get("database") or request.args.get("database")) as tenant:
+                if not await run(tenant.warmup.wait, WARMUP_WAIT_SECONDS):
+                    return jsonify({"error": "warming_up", "warmup": tenant.warmup.status()}), 503
+                await run(tenant.reload)
+        except UnknownTenantError as e:
+            return jsonify({"error": "unknown_database", "database": e.args[0]}), 404
+        return jsonify({"status": "schema reloaded", "database": tenant.name}), 200
+
+    return app
+
+if __name__ == "__main__":
+    app = create_async_app()
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
@@ -0,0 +1,188 @@
+# batch.py
+# Bulk NL-to-SQL runs: a JSONL file of questions against one database.
+# Identical questions are answered once, all translations go out in batched
+# LLM calls and all question embeddings in batched embedding calls before the
+# worker pool starts; each answer is appended to the output JSONL as soon as
+# it finishes, and a rerun skips every id already answered without error
+# (failed ones are retried unless --skip-errors).
+#
+#   python batch.py questions.jsonl --db sqlite:///employee.db --output answers.jsonl --workers 4
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tenants import Tenant, DEFAULT_TENANT
+from answer_pipeline import answer_question
+from llm_language_router import route_queries
+from query_cache import normalize_question
+from embeddings import get_embedder
+
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+
+
+def read_questions(path):
+    """
+    [(id, question)] from JSONL lines that are {"id": ..., "question": ...} objects or bare strings.
+    A line that is not valid JSON, or whose question is not a string, gets question None
+    (reported as an error record for that id) instead of stopping the run.
+    """
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = None
+            if isinstance(item, str):
+                item = {"question": item}
+            if not isinstance(item, dict):
+                records.append((str(line_no), None))
+                continue
+            question = item.get("question") or ""
+            records.append((str(item.get("id", line_no)), question if isinstance(question, str) else None))
+    return records
+
+def load_checkpoint(output_path, retry_errors=True):
+    """
+    Ids already answered in output_path; a half-written last line from a crash is cut off.
+    With retry_errors, lines that failed (often a transient LLM or database error) are
+    removed from the file and their ids left out, so the run answers them again.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    kept = []
+    for line in data[:end].splitlines():
+        try:
+            result = json.loads(line)
+            record_id = str(result["id"])
+        except (ValueError, KeyError, TypeError):
+            continue
+        if retry_errors and result.get("error") is not None:
+            continue
+        done.add(record_id)
+        kept.append(line)
+    if len(kept) < len(data[:end].splitlines()):
+        # rewrite without the dropped lines; os.replace keeps the old file intact until then
+        with open(output_path + ".tmp", "wb") as f:
+            f.write(b"".join(line + b"\n" for line in kept))
+        os.replace(output_path + ".tmp", output_path)
+    return done
+
+def load_tenant(connection_string, name=DEFAULT_TENANT):
+    # the collection is namespaced by name and URL, so a run never touches another database's store
+    return Tenant(name, connection_string).load()
+
+
+def answer_record(tenant, question, english_query=None):
+    # one output line's worth of answer_question: batch questions are all fresh and
+    # one-off, and a fix that ran successfully replaces the failed query
+    start = time.perf_counter()
+    body = answer_question(tenant, question, english_query=english_query)
+    answer = {k: body[k] for k in ("english_question", "agent_output", "sql", "rows", "error", "heal", "cache", "pipeline")}
+    answer["guard"] = {k: body["guard"][k] for k in ("action", "reasons")} if body["guard"] else None
+    if not body["sql"]:
+        answer["error"] = "no SQL in agent output"
+    elif body.get("executed") is False:
+        answer["error"] = body["reason"]
+    elif body["fix_result"] is not None:
+        answer.update(sql=body["gemini_suggestion"], rows=body["fix_result"], error=None)
+    answer["elapsed_ms"] = (time.perf_counter() - start) * 1000
+    return answer
+
+def iter_batch(records, tenant, workers=BATCH_WORKERS, skip_ids=()):
+    """
+    Answer [(id, question)] and yield one {"id", "question", ...answer} dict per
+    record, in completion order. Records whose id is in skip_ids are left out.
+    """
+    groups = {}
+    for record_id, question in records:
+        if record_id in skip_ids:
+            continue
+        if question is None:
+            yield {"id": record_id, "question": None, "sql": None, "rows": None,
+                   "error": "invalid line: expected a string or an object with a string 'question'"}
+            continue
+        if not question.strip():
+            yield {"id": record_id, "question": question, "sql": None, "rows": None, "error": "missing 'question' field"}
+            continue
+        # identical questions (after normalization) are answered once and fanned out
+        groups.setdefault(normalize_question(question), []).append((record_id, question))
+    if not groups:
+        return
+    questions = [members[0][1] for members in groups.values()]
+
+    try:
+        english = route_queries(questions)
+        # warm the embedding cache in batched calls; retrieval in the workers then hits it
+        get_embedder().embed_documents(list(dict.fromkeys(english)))
+    except Exception:
+        # batching is only an optimization: each worker translates/embeds its own question
+        english = [None] * len(questions)
+
+    def work(question, english_query):
+        try:
+            return answer_record(tenant, question, english_query)
+        except Exception as e:
+            return {"english_question": english_query, "sql": None, "rows": None, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(work, q, e): members for q, e, members in zip(questions, english, groups.values())}
+        for future in as_completed(futures):
+            answer = future.result()
+            for record_id, question in futures[future]:
+                yield dict(answer, id=record_id, question=question)
+
+def run_batch(input_path, connection_string, output_path, workers=BATCH_WORKERS, resume=True, tenant=None,
+              retry_errors=True):
+    """Answer every question in input_path, appending results to output_path; returns a summary."""
+    start = time.perf_counter()
+    records = read_questions(input_path)
+    if not resume and os.path.exists(output_path):
+        os.remove(output_path)
+    done = load_checkpoint(output_path, retry_errors)
+    tenant = tenant or load_tenant(connection_string)
+    written = errors = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        for result in iter_batch(records, tenant, workers, skip_ids=done):
+            out.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+            # every finished line is a checkpoint
+            out.flush()
+            written += 1
+            errors += result.get("error") is not None
+    return {
+        "total": len(records),
+        "skipped": len(done),
+        "written": written,
+        "errors": errors,
+        "elapsed_s": time.perf_counter() - start
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions against one database")
+    parser.add_argument("input", help="JSONL: {\"id\": ..., \"question\": ...} objects or bare strings")
+    parser.add_argument("--db", default=os.getenv("DATABASE_URL", "sqlite:///example.db"), help="SQLAlchemy URL")
+    parser.add_argument("--output", required=True, help="JSONL results, appended as questions finish")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--no-resume", action="store_true", help="start over instead of skipping answered ids")
+    parser.add_argument("--skip-errors", action="store_true",
+                        help="on resume, treat ids that failed as done instead of retrying them")
+    args = parser.parse_args(argv)
+    summary = run_batch(args.input, args.db, args.output, args.workers, resume=not args.no_resume,
+                        retry_errors=not args.skip_errors)
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+# benchmark.py
+# Offline benchmark for the NL-to-SQL pipeline. Gemini and the embedding API
+# are replaced by deterministic local fakes (with configurable latency), the
+# database is a synthetic SQLite file in the style of init_db.py, and every
+# stage is timed separately. Output is JSON so runs can be diffed between commits.
+#
+#   python benchmark.py --tables 5,50,500 --iterations 20 --output bench.json
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def build_synthetic_db(path, n_tables, rows_per_table=50, seed=7):
+    """Tables t0..tN-1, each with a foreign key to the previous one."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cities = ["Delhi", "Mumbai", "Ahmedabad", "Chandigarh", "Kolkata"]
+    for i in range(n_tables):
+        fk = f",\n    parent_id INTEGER,\n    FOREIGN KEY (parent_id) REFERENCES t{i - 1}(id)" if i else ""
+        cursor.execute(f"""
+CREATE TABLE IF NOT EXISTS t{i} (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    city TEXT,
+    amount REAL,
+    created_at TEXT{fk}
+)
+""")
+        rows = []
+        for r in range(rows_per_table):
+            row = [r + 1, f"name_{i}_{r}", rng.choice(cities), round(rng.uniform(10, 1000), 2), f"2025-07-{r % 28 + 1:02d}"]
+            if i:
+                row.append(rng.randint(1, rows_per_table))
+            rows.append(tuple(row))
+        cursor.executemany(f"INSERT INTO t{i} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+    conn.commit()
+    conn.close()
+
+
+def summarize(samples, peak_bytes):
+    ordered = sorted(samples)
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))] * 1000
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "mean_ms": total / len(samples) * 1000,
+        "throughput_per_s": len(samples) / total if total else None,
+        "peak_mem_kb": peak_bytes / 1024
+    }
+
+def timed(fn, iterations):
+    samples = []
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    result = None
+    for i in range(iterations):
+        start = time.perf_counter()
+        result = fn(i)
+        samples.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    # peak allocated above what was live when the stage started
+    return summarize(samples, peak - baseline), result
+
+
+def run_size(n_tables, iterations, workdir, llm_latency, embed_latency):
+    # imported here so the env/cwd set up in main() applies to module-level config
+    import embeddings
+    import sql_repair
+    from schema_extractor import extract_schema, load_schema
+    from vector_store import create_schema_store, query_schema_store
+    from schema_index import SchemaIndex
+    from agent_runner import build_agent
+    from direct_pipeline import direct_sql
+    from tools import run_sql
+    from result_cache import result_cache
+    from llm_gateway import gateway, FakeChatModel
+    from db_engine import dispose_engine
+
+    db_path = os.path.join(workdir, f"bench_{n_tables}.db")
+    build_synthetic_db(db_path, n_tables)
+    cs = f"sqlite:///{db_path}"
+    questions = [f"What is the total amount per city in t{random.Random(q).randrange(n_tables)}?" for q in range(iterations)]
+    stages = {}
+
+    stages["extract_schema_cold"], schema = timed(lambda i: extract_schema(cs, use_cache=False), iterations)
+    load_schema(cs)
+    stages["extract_schema_cached"], (schema, schema_text) = timed(lambda i: load_schema(cs), iterations)
+    chunks = schema_text.split("\n\n")
+
+    def cold_store(i):
+        # fresh embedder and store every time: every chunk is embedded and written
+        embeddings.set_embedding_backend(embeddings.FakeEmbeddings(latency=embed_latency), cache_path=None)
+        return create_schema_store(chunks, persist_dir=os.path.join(workdir, f"store_{n_tables}_{i}"))
+    store_iterations = max(1, min(iterations, 3))
+    stages["create_schema_store_cold"], collection = timed(cold_store, store_iterations)
+    persist_dir = os.path.join(workdir, f"store_{n_tables}_0")
+    stages["create_schema_store_reload"], collection = timed(
+        lambda i: create_schema_store(chunks, persist_dir=persist_dir), iterations)
+
+    embeddings.set_embedding_backend(embeddings.FakeEmbeddings(latency=embed_latency), cache_path=None)
+    stages["query_schema_store"], _ = timed(lambda i: query_schema_store(collection, questions[i]), iterations)
+    stages["schema_index_build"], index = timed(lambda i: SchemaIndex(schema, collection), iterations)
+    stages["schema_index_search"], _ = timed(lambda i: index.search(questions[i]), iterations)
+
+    llm = FakeChatModel(latency=llm_latency)
+    # translation, SQL generation and self-heal prompts all go through the gateway
+    gateway.set_backend(llm)
+    # bound to the benchmark database: the fake model scripts generate_sql_tool ->
+    # execute_sql_tool -> answer, so each invoke runs the agent's whole tool loop
+    agent = build_agent(with_memory=False, llm=llm, connection_string=cs)
+    contexts = ["\n".join(index.search(q)) for q in questions]
+    stages["agent_invoke"], _ = timed(lambda i: agent.invoke({
+        "input": f"{questions[i]}\n\nSCHEMA CONTEXT:\n{contexts[i]}",
+        "chat_history": []
+    }), iterations)
+    stages["direct_sql"], _ = timed(lambda i: direct_sql(questions[i], contexts[i], cs), iterations)
+
+    def uncached_sql(i):
+        result_cache.clear()
+        return run_sql(cs, f"SELECT city, SUM(amount) FROM t{i % n_tables} GROUP BY city")
+    stages["execute_sql_tool"], _ = timed(uncached_sql, iterations)
+    stages["execute_sql_tool_cached"], _ = timed(lambda i: run_sql(cs, "SELECT city, SUM(amount) FROM t0 GROUP BY city"), iterations)
+
+    # self-heal: a typo the local tier fixes, and an error only the (fake) LLM can fix
+    stages["self_heal_local"], _ = timed(lambda i: sql_repair.heal_sql(
+        cs, schema, schema_text, f"SELECT nmae FROM t{i % n_tables}", "no such column: nmae"), iterations)
+    stages["self_heal_llm"], _ = timed(lambda i: sql_repair.heal_sql(
+        cs, schema, schema_text, "SELECT frobnicate(id) FROM t0", "no such function: frobnicate"), iterations)
+
+    dispose_engine(cs)
+    return {
+        "tables": n_tables,
+        "iterations": iterations,
+        "llm_calls": llm.calls,
+        "embedding_stats": embeddings.embedding_stats(),
+        "stages": stages
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline NL-to-SQL pipeline benchmark")
+    parser.add_argument("--tables", default="5,50,500", help="comma-separated table counts")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per fake LLM call")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds per fake embedding call")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="nl2sql_bench_")
+    # keep every cache and vector store of the run inside the scratch dir
+    os.environ.update({
+        "EMBED_BACKEND": "fake",
+        "LLM_BACKEND": "fake",
+        "EMBED_CACHE_PATH": "",
+        "TRANSLATION_CACHE_PATH": "",
+        "SCHEMA_CACHE_DIR": os.path.join(workdir, "schema_cache")
+    })
+    os.environ.setdefault("GOOGLE_API", "offline-benchmark")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    tracemalloc.start()
+    try:
+        # the pipeline prints progress to stdout; keep stdout for the JSON report
+        with contextlib.redirect_stdout(sys.stderr):
+            report = {
+                "python": sys.version.split()[0],
+                "llm_latency": args.llm_latency,
+                "embed_latency": args.embed_latency,
+                "runs": [run_size(int(n), args.iterations, workdir, args.llm_latency, args.embed_latency)
+                         for n in args.tables.split(",")]
+            }
+    finally:
+        tracemalloc.stop()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# db_engine.py
+# Process-wide SQLAlchemy engines, one per connection string, so every query
+# reuses a warm connection pool instead of building a new engine.
+import os
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+_engines = {}
+_wait_stats = {}
+_lock = threading.Lock()
+
+def _engine_kwargs(connection_string):
+    url = make_url(connection_string)
+    kwargs = {"pool_pre_ping": POOL_PRE_PING}
+    if url.get_backend_name() == "sqlite":
+        kwargs["connect_args"] = {"check_same_thread": False}
+        # in-memory sqlite uses a singleton pool that takes no sizing options
+        if url.database in (None, "", ":memory:"):
+            return kwargs
+    kwargs.update(
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE
+    )
+    return kwargs
+
+def get_engine(connection_string):
+    engine = _engines.get(connection_string)
+    if engine is not None:
+        return engine
+    with _lock:
+        engine = _engines.get(connection_string)
+        if engine is None:
+            engine = create_engine(connection_string, **_engine_kwargs(connection_string))
+            _engines[connection_string] = engine
+            _wait_stats[connection_string] = {"checkouts": 0, "wait_total": 0.0, "wait_max": 0.0}
+    return engine
+
+@contextmanager
+def connect(connection_string):
+    engine = get_engine(connection_string)
+    start = time.perf_counter()
+    conn = engine.connect()
+    waited = time.perf_counter() - start
+    with _lock:
+        stats = _wait_stats.setdefault(connection_string, {"checkouts": 0, "wait_total": 0.0, "wait_max": 0.0})
+        stats["checkouts"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def dispose_engine(connection_string=None):
+    # drop one engine (or all of them); the next get_engine call builds a fresh pool
+    with _lock:
+        urls = [connection_string] if connection_string else list(_engines)
+        for url in urls:
+            engine = _engines.pop(url, None)
+            _wait_stats.pop(url, None)
+            if engine is not None:
+                engine.dispose()
+
+def reload_engine(connection_string):
+    dispose_engine(connection_string)
+    return get_engine(connection_string)
+
+def pool_stats(connection_string=None):
+    urls = [connection_string] if connection_string else list(_engines)
+    report = {}
+    for url in urls:
+        engine = _engines.get(url)
+        if engine is None:
+            continue
+        pool = engine.pool
+        sized = isinstance(pool, QueuePool)
+        waits = dict(_wait_stats.get(url, {}))
+        checkouts = waits.get("checkouts", 0)
+        report[engine.url.render_as_string(hide_password=True)] = {
+            "pool_class": type(pool).__name__,
+            "size": pool.size() if sized else None,
+            "checked_out": pool.checkedout() if sized else None,
+            "checked_in": pool.checkedin() if sized else None,
+            "overflow": pool.overflow() if sized else None,
+            "checkouts": checkouts,
+            "wait_avg_ms": (waits.get("wait_total", 0.0) / checkouts * 1000) if checkouts else 0.0,
+            "wait_max_ms": waits.get("wait_max", 0.0) * 1000
+        }
+    return report
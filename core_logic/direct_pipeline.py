@@ -0,0 +1,58 @@
+# direct_pipeline.py
+# The fast path for fresh questions: one structured-output LLM call turns the
+# question and the retrieved schema context into SQL. The agent needs at least
+# two round trips for the same answer (plan + generate_sql_tool, then the final
+# reply) and leaves the SQL in a fenced block that has to be fished out of free
+# text. The agent is kept for follow-ups, which need the conversation, and for
+# questions the model flags as needing more than one query.
+import os
+from pydantic import BaseModel, Field
+from sqlalchemy.engine import make_url
+from llm_gateway import gateway
+import metrics
+
+# off = every question goes through the agent, as before
+DIRECT_PIPELINE = os.getenv("DIRECT_PIPELINE", "1").lower() not in ("0", "false", "no")
+
+
+class SQLAnswer(BaseModel):
+    """A single query answering the user's question."""
+
+    sql: str = Field("", description="One SELECT statement that answers the question; empty if the schema cannot answer it")
+    needs_agent: bool = Field(False, description="True only if answering needs several dependent queries or a clarifying question")
+    explanation: str = Field("", description="One short sentence describing what the query returns")
+
+
+DIRECT_PROMPT = """You write {dialect} SQL for a read-only database.
+Use only the tables and columns in the schema below. Return a single SELECT
+statement that answers the question; prefer explicit JOINs over subqueries.
+
+SCHEMA:
+{schema_context}
+
+QUESTION:
+{question}"""
+
+def use_direct(history):
+    # follow-ups need the conversation, which only the agent sees
+    return DIRECT_PIPELINE and (history is None or history.is_empty())
+
+def direct_sql(question, schema_context, connection_string):
+    """SQLAnswer for the question, or None when the agent should take over."""
+    prompt = DIRECT_PROMPT.format(dialect=make_url(connection_string).get_backend_name(),
+                                  schema_context=schema_context, question=question)
+    try:
+        answer = gateway.invoke(prompt, schema=SQLAnswer)
+    except ValueError:
+        # the model answered without filling the schema (output parser / validation error)
+        answer = None
+    if answer is None or answer.needs_agent or not answer.sql.strip():
+        metrics.incr("direct_pipeline", result="fallback")
+        return None
+    metrics.incr("direct_pipeline", result="answered")
+    return answer
+
+def direct_output(answer):
+    # shaped like the agent's reply, so clients and the question cache see the same agent_output
+    explanation = f"{answer.explanation.strip()}\n\n" if answer.explanation.strip() else ""
+    return f"{explanation}```sql\n{answer.sql.strip()}\n```"
@@ -0,0 +1,220 @@
+# embeddings.py
+# One embedding provider shared by the schema store and the error-pattern store.
+# Vectors are memoized in a bounded in-memory LRU and an on-disk sqlite table
+# keyed by (model, sha256(text)); concurrent misses are coalesced into a
+# single embed_documents call on the backing model.
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "google")
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "models/embedding-001")
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "embedding_cache.db")
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "100"))
+# how long the first caller with a miss waits for others to join its batch
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "2"))
+
+
+class FakeEmbeddings:
+    """Deterministic local embedder: hashed bag of words, L2-normalized."""
+
+    def __init__(self, dims=64, latency=0.0, model="fake-embedding"):
+        self.dims = dims
+        self.latency = latency
+        self.model = model
+        self.calls = 0
+
+    def _embed(self, text):
+        vec = [0.0] * self.dims
+        for token in re.findall(r"\w+", text.lower()):
+            h = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:4], "little")
+            vec[h % self.dims] += 1.0 if h & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def _default_backend():
+    if EMBED_BACKEND == "fake":
+        return FakeEmbeddings()
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(
+        model=EMBED_MODEL_NAME,
+        google_api_key=os.getenv("GOOGLE_API")
+    )
+
+
+class CachedEmbeddings:
+    def __init__(self, backend, cache_size=EMBED_CACHE_SIZE, cache_path=EMBED_CACHE_PATH,
+                 max_batch=EMBED_MAX_BATCH, batch_window_ms=EMBED_BATCH_WINDOW_MS):
+        self.backend = backend
+        self.model = getattr(backend, "model", type(backend).__name__)
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self.batch_window = batch_window_ms / 1000.0
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._queue = []
+        self._flushing = False
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "backend_calls": 0}
+        self._db = None
+        if cache_path:
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT, text_hash TEXT, vector BLOB, PRIMARY KEY (model, text_hash))"
+            )
+            self._db.commit()
+
+    def _key(self, text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        # caller holds self._lock
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.cache_size:
+            self._lru.popitem(last=False)
+
+    def _disk_get(self, keys):
+        if self._db is None or not keys:
+            return {}
+        found = {}
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            rows = self._db.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(part))})",
+                [self.model, *part]
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = array("d", blob).tolist()
+        return found
+
+    def _disk_put(self, items):
+        if self._db is None or not items:
+            return
+        self._db.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+            [(self.model, key, array("d", vec).tobytes()) for key, vec in items]
+        )
+        self._db.commit()
+
+    def _flush(self):
+        if self.batch_window:
+            time.sleep(self.batch_window)
+        while True:
+            with self._lock:
+                batch = self._queue[:self.max_batch]
+                del self._queue[:self.max_batch]
+                if not batch:
+                    self._flushing = False
+                    return
+                self._counters["backend_calls"] += 1
+            try:
+                vectors = self.backend.embed_documents([text for _, text, _ in batch])
+                with self._lock:
+                    self._disk_put([(key, vec) for (key, _, _), vec in zip(batch, vectors)])
+                    for (key, _, _), vec in zip(batch, vectors):
+                        self._remember(key, vec)
+                        self._pending.pop(key, None)
+                for (_, _, fut), vec in zip(batch, vectors):
+                    fut.set_result(vec)
+            except Exception as e:
+                with self._lock:
+                    for key, _, _ in batch:
+                        self._pending.pop(key, None)
+                for _, _, fut in batch:
+                    fut.set_exception(e)
+
+    def embed_documents(self, texts):
+        keys = [self._key(t) for t in texts]
+        results = {}
+        with self._lock:
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    results[key] = self._lru[key]
+                    self._counters["memory_hits"] += 1
+            missing = [k for k in dict.fromkeys(keys) if k not in results]
+            from_disk = self._disk_get(missing)
+            for key, vec in from_disk.items():
+                self._remember(key, vec)
+                results[key] = vec
+            self._counters["disk_hits"] += len(from_disk)
+
+            futures = {}
+            for key, text in zip(keys, texts):
+                if key in results or key in futures:
+                    continue
+                fut = self._pending.get(key)
+                if fut is None:
+                    fut = Future()
+                    self._pending[key] = fut
+                    self._queue.append((key, text, fut))
+                    self._counters["misses"] += 1
+                else:
+                    # already being embedded for another caller
+                    self._counters["coalesced"] += 1
+                futures[key] = fut
+            leader = bool(self._queue) and not self._flushing
+            if leader:
+                self._flushing = True
+
+        if leader:
+            self._flush()
+        for key, fut in futures.items():
+            results[key] = fut.result()
+        return [results[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def stats(self):
+        with self._lock:
+            report = dict(self._counters)
+            report["memory_entries"] = len(self._lru)
+        lookups = report["memory_hits"] + report["disk_hits"] + report["coalesced"] + report["misses"]
+        report["hit_rate"] = (lookups - report["misses"]) / lookups if lookups else 0.0
+        return report
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = CachedEmbeddings(_default_backend())
+    return _embedder
+
+def set_embedding_backend(backend, **kwargs):
+    # swap the backing model, e.g. FakeEmbeddings() in tests and benchmarks
+    global _embedder
+    with _embedder_lock:
+        _embedder = CachedEmbeddings(backend, **kwargs)
+    return _embedder
+
+def embedding_stats():
+    return _embedder.stats() if _embedder is not None else {}
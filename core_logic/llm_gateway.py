@@ -0,0 +1,247 @@
+# llm_gateway.py
+# The single way out to the LLM. Clients are built once per model and shared,
+# a token bucket (attached to every client, so the agent loop is throttled
+# too) keeps us under the provider's rate limit, identical prompts in flight
+# at the same time are sent once, throttling/transient errors are retried with
+# jittered exponential backoff, and every call has a wall-clock timeout.
+# Calls can ask for structured output (a Pydantic schema filled by tool calling)
+# instead of free text.
+# LLM_BACKEND=fake swaps in a deterministic local model for tests and benchmarks.
+import contextvars
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dotenv import load_dotenv
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, FunctionMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+import metrics
+
+load_dotenv()
+GOOGLE_API_KEY = os.getenv("GOOGLE_API")
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "google")
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.0-flash")
+# token bucket: sustained requests per second and burst size; 0 disables
+LLM_RATE_PER_SEC = float(os.getenv("LLM_RATE_PER_SEC", "5"))
+LLM_BURST = int(os.getenv("LLM_BURST", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "20"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+# threads that carry gateway calls (and let us stop waiting on a hung one)
+LLM_GATEWAY_WORKERS = int(os.getenv("LLM_GATEWAY_WORKERS", "16"))
+
+
+class LLMTimeoutError(TimeoutError):
+    """The model did not answer within the gateway's per-call timeout."""
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline stand-in for Gemini. Translation prompts get their text (or JSON
+    array) back unchanged; everything else gets a fenced SELECT over the last
+    table the prompt mentions (unfenced in the "sql" field for structured output).
+    Bound to the agent's functions it follows a fixed script, so the tool loop
+    runs for real: generate_sql_tool, then execute_sql_tool, then the final answer.
+    """
+
+    latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-sql"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        scripted = self._agent_step(messages, kwargs.get("functions") or [])
+        if scripted is not None:
+            return ChatResult(generations=[ChatGeneration(message=scripted)])
+        prompt = "\n".join(str(m.content) for m in messages)
+        if prompt.lstrip().startswith("Translate"):
+            content = prompt.split("\n\n", 1)[-1].strip()
+        else:
+            tables = re.findall(r"Table: (\w+)", prompt)
+            sql = f"SELECT * FROM {tables[-1] if tables else 'sqlite_master'} LIMIT 10"
+            content = f"```sql\n{sql}\n```"
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _agent_step(self, messages, functions):
+        # the agent's next move, judged from the last tool call in its scratchpad
+        names = {f.get("name"): f for f in functions}
+        if "generate_sql_tool" not in names:
+            return None
+        calls = [m for m in messages if isinstance(m, AIMessage) and m.additional_kwargs.get("function_call")]
+        if not calls:
+            question, _, context = str(messages[-1].content).partition("\n\nSCHEMA CONTEXT:\n")
+            return self._function_call("generate_sql_tool", {"question": question, "schema_context": context})
+        last = calls[-1].additional_kwargs["function_call"]
+        if last["name"] == "generate_sql_tool":
+            result = next(m for m in reversed(messages) if isinstance(m, FunctionMessage))
+            sql = re.sub(r"^```(?:sql)?\s*|\s*```$", "", str(result.content).strip())
+            # only the bound tool (whose one argument is the SQL) runs without a URL from the model
+            if set(names.get("execute_sql_tool", {}).get("parameters", {}).get("properties", {})) == {"sql"}:
+                return self._function_call("execute_sql_tool", {"sql": sql})
+        else:
+            sql = json.loads(last["arguments"]).get("sql", "")
+        return AIMessage(content=f"```sql\n{sql}\n```")
+
+    @staticmethod
+    def _function_call(name, arguments):
+        return AIMessage(content="", additional_kwargs={"function_call": {"name": name, "arguments": json.dumps(arguments)}})
+
+    def with_structured_output(self, schema, **kwargs):
+        # no tool calling here: fill the schema's "sql" field from the plain reply
+        from langchain_core.runnables import RunnableLambda
+        def parse(prompt, config=None):
+            reply = self.invoke(prompt, config=config).content.strip()
+            return schema(sql=re.sub(r"^```(?:sql)?\s*|\s*```$", "", reply))
+        return RunnableLambda(parse)
+
+
+def retryable_errors():
+    # throttling, overload and timeouts; bad requests and auth errors fail fast
+    errors = [TimeoutError, ConnectionError]
+    try:
+        from google.api_core import exceptions
+        errors += [exceptions.ResourceExhausted, exceptions.ServiceUnavailable,
+                   exceptions.DeadlineExceeded, exceptions.InternalServerError]
+    except ImportError:
+        pass
+    return tuple(errors)
+
+def _content(response):
+    if isinstance(response, dict) and 'content' in response:
+        return response['content']
+    return getattr(response, "content", None) or str(response)
+
+
+class LLMGateway:
+    def __init__(self, backend=LLM_BACKEND, rate=LLM_RATE_PER_SEC, burst=LLM_BURST,
+                 max_retries=LLM_MAX_RETRIES, timeout=LLM_TIMEOUT_SECONDS):
+        self.backend = backend
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiter = None
+        if rate > 0:
+            from langchain_core.rate_limiters import InMemoryRateLimiter
+            self.rate_limiter = InMemoryRateLimiter(
+                requests_per_second=rate, check_every_n_seconds=0.05, max_bucket_size=burst)
+        self._clients = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=LLM_GATEWAY_WORKERS, thread_name_prefix="llm")
+
+    def set_backend(self, backend):
+        # "google", "fake", or a LangChain chat model instance served for every model name
+        with self._lock:
+            self.backend = backend
+            self._clients.clear()
+
+    def get_chat_model(self, model=LLM_MODEL):
+        """The shared client for `model`; also what the agent is built on."""
+        with self._lock:
+            client = self._clients.get(model)
+            if client is None:
+                if isinstance(self.backend, BaseChatModel):
+                    client = self.backend
+                elif self.backend == "fake":
+                    client = FakeChatModel(rate_limiter=self.rate_limiter)
+                else:
+                    from langchain_google_genai import ChatGoogleGenerativeAI
+                    # max_retries=0: the gateway (and the agent's with_retry) is the retry layer;
+                    # client retries would multiply with ours and keep going in an abandoned pool
+                    # thread after the gateway timeout. (langchain-google-genai 2.1.x still makes
+                    # up to 2 attempts per chat call regardless of this setting.)
+                    client = ChatGoogleGenerativeAI(
+                        model=model,
+                        google_api_key=GOOGLE_API_KEY,
+                        timeout=self.timeout,
+                        max_retries=0,
+                        rate_limiter=self.rate_limiter
+                    )
+                self._clients[model] = client
+            return client
+
+    def get_structured_model(self, schema, model=LLM_MODEL):
+        """`model` bound to answer with an instance of the Pydantic class `schema`."""
+        client = self.get_chat_model(model)
+        with self._lock:
+            runnable = self._clients.get((model, schema))
+            if runnable is None:
+                runnable = self._clients[(model, schema)] = client.with_structured_output(schema)
+            return runnable
+
+    def invoke(self, prompt, model=LLM_MODEL, timeout=None, schema=None):
+        """
+        Text of the model's reply, or an instance of `schema` when one is given.
+        Identical concurrent prompts share one call.
+        """
+        name = schema.__name__ if schema is not None else ""
+        key = hashlib.sha256(f"{model}\0{name}\0{prompt}".encode("utf-8")).hexdigest()
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+        if not leader:
+            metrics.incr("llm_coalesced")
+            return future.result()
+        try:
+            reply = self._call_with_retries(prompt, model, timeout or self.timeout, schema)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(reply)
+            return reply
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _call_with_retries(self, prompt, model, timeout, schema=None):
+        client = self.get_chat_model(model) if schema is None else self.get_structured_model(schema, model)
+        retryable = retryable_errors()
+        for attempt in range(self.max_retries + 1):
+            try:
+                reply = self._call(client, prompt, timeout)
+                return _content(reply) if schema is None else reply
+            except retryable as e:
+                if attempt == self.max_retries:
+                    raise
+                metrics.incr("llm_retries", error=type(e).__name__)
+                # full jitter: callers throttled together don't retry together
+                time.sleep(random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt)))
+
+    def _call(self, client, prompt, timeout):
+        # run in the gateway pool so a hung request can be abandoned; the copied
+        # context keeps the per-request metrics attached
+        context = contextvars.copy_context()
+        future = self._pool.submit(context.run, client.invoke, prompt, config={"callbacks": metrics.callbacks()})
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            metrics.incr("llm_timeouts")
+            raise LLMTimeoutError(f"LLM call exceeded {timeout:g}s (LLM_TIMEOUT_SECONDS)") from None
+
+    def retry_policy(self):
+        # the same policy as keyword arguments for Runnable.with_retry (used for the agent)
+        return {
+            "retry_if_exception_type": retryable_errors(),
+            "wait_exponential_jitter": True,
+            "exponential_jitter_params": {"initial": LLM_RETRY_BASE_SECONDS, "max": LLM_RETRY_MAX_SECONDS},
+            "stop_after_attempt": self.max_retries + 1
+        }
+
+
+gateway = LLMGateway()
@@ -1,27 +1,184 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
+from collections import OrderedDict
+import hashlib
+import json
 import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from llm_gateway import gateway
 
 load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API")
+
+TRANSLATION_CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH", "translation_cache.db")
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "20000"))
+# texts sent to the LLM in one translate_many call
+TRANSLATION_BATCH_SIZE = int(os.getenv("TRANSLATION_BATCH_SIZE", "20"))
+
+# Unicode blocks of the scripts we expect besides Latin
+SCRIPT_RANGES = [
+    (0x0900, 0x097F, "devanagari"),
+    (0x0980, 0x09FF, "bengali"),
+    (0x0A00, 0x0A7F, "gurmukhi"),
+    (0x0A80, 0x0AFF, "gujarati"),
+    (0x0B00, 0x0B7F, "oriya"),
+    (0x0B80, 0x0BFF, "tamil"),
+    (0x0C00, 0x0C7F, "telugu"),
+    (0x0C80, 0x0CFF, "kannada"),
+    (0x0D00, 0x0D7F, "malayalam"),
+    (0x0600, 0x06FF, "arabic"),
+    (0xA8E0, 0xA8FF, "devanagari"),
+]
+
+def char_script(c):
+    """'latin', another script name, or None for digits, punctuation, symbols and spaces."""
+    cp = ord(c)
+    for start, end, name in SCRIPT_RANGES:
+        if start <= cp <= end:
+            return name
+    category = unicodedata.category(c)
+    if category.startswith("L"):
+        # accented Latin letters (é, ñ, ...) are still English-compatible text
+        return "latin" if "LATIN" in unicodedata.name(c, "") else "other"
+    return None
 
 def detect_language(text):
-    return 'en' if all(ord(c) < 128 for c in text) else 'non-en'
+    # only letters decide: "₹", digits and "é" no longer force a translation
+    return 'en' if all(char_script(c) in (None, "latin") for c in text) else 'non-en'
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip().lower()
+
+
+class TranslationCache:
+    """LRU in memory, persisted to sqlite and trimmed to max_entries by last use."""
+
+    def __init__(self, path=TRANSLATION_CACHE_PATH, max_entries=TRANSLATION_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, translation TEXT, last_used REAL)"
+            )
+            self._db.commit()
+
+    def _key(self, text):
+        return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+    def get(self, text):
+        key = self._key(text)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+            row = None
+            if self._db is not None:
+                row = self._db.execute("SELECT translation FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE translations SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self._remember(key, row[0])
+            return row[0]
+
+    def put(self, text, translation):
+        key = self._key(text)
+        with self._lock:
+            self._remember(key, translation)
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO translations (key, translation, last_used) VALUES (?, ?, ?)",
+                (key, translation, time.time())
+            )
+            count = self._db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            if count > self.max_entries:
+                self._db.execute(
+                    "DELETE FROM translations WHERE key IN "
+                    "(SELECT key FROM translations ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._db.commit()
+
+    def _remember(self, key, translation):
+        self._memory[key] = translation
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory)}
+
+
+translation_cache = TranslationCache()
+
+# code-mixed questions ("सभी employees की salary दिखाओ") are translated whole, in one call,
+# so the other-script words are read in context; the English words are often table or
+# column names and must come back untouched
+KEEP_LATIN = "Keep every word already written in English (Latin script), numbers and identifiers exactly as they are."
 
 def translate_to_english(text):
-    model = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
-        google_api_key=GOOGLE_API_KEY
-    )
-    prompt = f"Translate the following to English. Only output the English translation.\n\n{text}"
-    response = model.invoke(prompt)
-    if isinstance(response, dict) and 'content' in response:
-        return response['content']
-    return str(response)
+    cached = translation_cache.get(text)
+    if cached is not None:
+        return cached
+    prompt = f"Translate the following to English. {KEEP_LATIN} Only output the English translation.\n\n{text}"
+    translation = gateway.invoke(prompt).strip()
+    translation_cache.put(text, translation)
+    return translation
+
+def translate_many(texts, batch_size=TRANSLATION_BATCH_SIZE):
+    """{text: translation} for all texts, with one LLM call per batch of uncached texts."""
+    translations = {}
+    missing = []
+    for text in dict.fromkeys(texts):
+        cached = translation_cache.get(text)
+        if cached is None:
+            missing.append(text)
+        else:
+            translations[text] = cached
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        if len(batch) == 1:
+            translations[batch[0]] = translate_to_english(batch[0])
+            continue
+        prompt = ("Translate each string in the following JSON array to English. " + KEEP_LATIN +
+                  " Output only a JSON array of the translations, in the same order.\n\n"
+                  + json.dumps(batch, ensure_ascii=False))
+        reply = re.sub(r"^```(?:json)?\s*|\s*```$", "", gateway.invoke(prompt).strip())
+        try:
+            parsed = json.loads(reply)
+        except ValueError:
+            parsed = None
+        if not isinstance(parsed, list) or len(parsed) != len(batch):
+            # malformed batch reply: fall back to one call per text
+            for text in batch:
+                translations[text] = translate_to_english(text)
+            continue
+        for text, translation in zip(batch, parsed):
+            translation = str(translation).strip()
+            translation_cache.put(text, translation)
+            translations[text] = translation
+    return translations
 
 def route_query(query):
-    lang = detect_language(query)
-    if lang == 'en':
+    # English passes through; anything else (code-mixed included) is one cached translation
+    if detect_language(query) == 'en':
         return query
-    else:
-        return translate_to_english(query)
+    return translate_to_english(query)
+
+def route_queries(queries):
+    """route_query for many questions, translating all the non-English ones in batches."""
+    translations = translate_many([query for query in queries if detect_language(query) != 'en'])
+    return [translations.get(query, query) for query in queries]
@@ -0,0 +1,177 @@
+# metrics.py
+# Per-request timing spans and counters, aggregated into process-wide
+# histograms and rendered in the Prometheus text format for /metrics.
+# The current request lives in a contextvar, so spans opened anywhere below
+# a request (including LangChain callbacks and asyncio.to_thread workers)
+# land in that request's breakdown.
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+
+# seconds; covers sub-millisecond cache hits up to slow multi-round LLM repairs
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_histograms = {}   # stage -> {"buckets": [..], "sum": s, "count": n}
+_counters = {}     # (name, labels tuple) -> value
+_collectors = {}   # name -> fn() returning gauge values at scrape time
+_current = contextvars.ContextVar("nl2sql_request", default=None)
+
+
+class RequestMetrics:
+    def __init__(self, request_id=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+
+    def breakdown(self):
+        return {
+            "request_id": self.request_id,
+            "total_ms": (time.perf_counter() - self.started) * 1000,
+            "stages_ms": {stage: seconds * 1000 for stage, seconds in self.stages.items()},
+            "counters": dict(self.counters)
+        }
+
+
+def observe(stage, seconds):
+    with _lock:
+        hist = _histograms.setdefault(stage, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist["buckets"][i] += 1
+        hist["sum"] += seconds
+        hist["count"] += 1
+    current = _current.get()
+    if current is not None:
+        current.stages[stage] = current.stages.get(stage, 0.0) + seconds
+
+def incr(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    current = _current.get()
+    if current is not None:
+        current.counters[name] = current.counters.get(name, 0) + value
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+def begin_request(request_id=None):
+    request = RequestMetrics(request_id)
+    return request, _current.set(request)
+
+def end_request(request, token):
+    _current.reset(token)
+    observe("request", time.perf_counter() - request.started)
+    return request.breakdown()
+
+def record_llm_call(model, input_tokens=0, output_tokens=0):
+    incr("llm_calls", model=model)
+    if input_tokens:
+        incr("llm_input_tokens", input_tokens, model=model)
+    if output_tokens:
+        incr("llm_output_tokens", output_tokens, model=model)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Counts LangChain LLM calls/tokens and times the agent's internal tool calls."""
+
+    def __init__(self):
+        self._starts = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start = self._starts.pop(run_id, None)
+        if start is not None:
+            observe("llm_call", time.perf_counter() - start)
+        usage = {}
+        model = "unknown"
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or usage
+                model = (getattr(message, "response_metadata", None) or {}).get("model_name", model)
+        record_llm_call(model, usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+        incr("llm_errors")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._starts[run_id] = (time.perf_counter(), (serialized or {}).get("name", "tool"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        start, name = self._starts.pop(run_id, (None, None))
+        if start is not None:
+            observe(f"tool:{name}", time.perf_counter() - start)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+        incr("tool_errors")
+
+
+def callbacks():
+    # fresh handler per call: it keeps per-run start times
+    return [MetricsCallbackHandler()]
+
+def register_collector(name, fn):
+    """fn() -> {key: number} or {target: {key: number}}, read on every scrape."""
+    _collectors[name] = fn
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        histograms = {k: {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]} for k, v in _histograms.items()}
+        counters = dict(_counters)
+
+    lines.append("# HELP nl2sql_stage_seconds Time spent per pipeline stage.")
+    lines.append("# TYPE nl2sql_stage_seconds histogram")
+    for stage, hist in sorted(histograms.items()):
+        for bound, count in zip(BUCKETS, hist["buckets"]):
+            lines.append(f"nl2sql_stage_seconds_bucket{_labels([('stage', stage), ('le', bound)])} {count}")
+        lines.append(f"nl2sql_stage_seconds_bucket{_labels([('stage', stage), ('le', '+Inf')])} {hist['count']}")
+        lines.append(f"nl2sql_stage_seconds_sum{_labels([('stage', stage)])} {hist['sum']}")
+        lines.append(f"nl2sql_stage_seconds_count{_labels([('stage', stage)])} {hist['count']}")
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE nl2sql_{name}_total counter")
+        for (counter, labels), value in sorted(counters.items()):
+            if counter == name:
+                lines.append(f"nl2sql_{name}_total{_labels(labels)} {value}")
+
+    for name, fn in sorted(_collectors.items()):
+        try:
+            values = fn() or {}
+        except Exception:
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, dict):
+                for sub_key, sub_value in sorted(value.items()):
+                    if isinstance(sub_value, (int, float)) and not isinstance(sub_value, bool):
+                        lines.append(f"nl2sql_{name}_{sub_key}{_labels([('target', key)])} {sub_value}")
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"nl2sql_{name}_{key} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,121 @@
+# query_cache.py
+# Maps (normalized question, schema fingerprint) -> validated SQL so repeated
+# questions skip translation and the agent. Entries expire by TTL and are
+# evicted LRU; an optional embedding-similarity lookup catches rephrasings.
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from embeddings import get_embedder
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1000"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+# 0 disables similarity hits; e.g. 0.95 reuses SQL for near-identical wording
+QUERY_CACHE_SIMILARITY = float(os.getenv("QUERY_CACHE_SIMILARITY", "0"))
+
+def normalize_question(question):
+    q = re.sub(r"\s+", " ", question.strip().lower())
+    return q.rstrip(" ?.!।")
+
+def schema_fingerprint(schema_text):
+    return hashlib.sha256(schema_text.encode("utf-8")).hexdigest()[:16]
+
+def _unit(vector):
+    # stored normalized, so a similarity lookup is one dot product per entry
+    norm = math.sqrt(sum(x * x for x in vector))
+    return [x / norm for x in vector] if norm else None
+
+
+class QuestionCache:
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL, similarity=QUERY_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def _expired(self, entry):
+        return self.ttl and time.monotonic() - entry["stored_at"] > self.ttl
+
+    def get(self, question, fingerprint):
+        key = (normalize_question(question), fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def get_similar(self, english_question, fingerprint):
+        if not self.similarity:
+            return None
+        vector = _unit(get_embedder().embed_query(normalize_question(english_question)))
+        if vector is None:
+            return None
+        # copy the candidates under the lock, score them outside it: the scan is
+        # O(entries x dimensions) and must not block exact lookups and puts
+        with self._lock:
+            candidates = [(key, entry) for key, entry in self._entries.items()
+                          if key[1] == fingerprint and entry.get("vector") is not None and not self._expired(entry)]
+        best, best_entry, best_score = None, None, self.similarity
+        for key, entry in candidates:
+            score = sum(x * y for x, y in zip(vector, entry["vector"]))
+            if score >= best_score:
+                best, best_entry, best_score = key, entry, score
+        if best is None:
+            return None
+        with self._lock:
+            # only refresh its LRU position if it was not replaced or evicted meanwhile
+            if self._entries.get(best) is best_entry:
+                self._entries.move_to_end(best)
+            self.similar_hits += 1
+        return dict(best_entry, score=best_score)
+
+    def put(self, question, fingerprint, sql, agent_output=None, english_question=None):
+        vector = None
+        if self.similarity and english_question:
+            vector = _unit(get_embedder().embed_query(normalize_question(english_question)))
+        key = (normalize_question(question), fingerprint)
+        with self._lock:
+            self._entries[key] = {
+                "sql": sql,
+                "agent_output": agent_output,
+                "english_question": english_question,
+                "vector": vector,
+                "stored_at": time.monotonic()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keep_fingerprint=None, drop_fingerprint=None):
+        # drop every entry built against a different (i.e. stale) schema; with
+        # drop_fingerprint, only that schema's entries (other databases keep theirs)
+        with self._lock:
+            if drop_fingerprint is not None:
+                stale = [k for k in self._entries if k[1] == drop_fingerprint]
+            else:
+                stale = [k for k in self._entries if k[1] != keep_fingerprint]
+            for key in stale:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses
+            }
+
+
+question_cache = QuestionCache()
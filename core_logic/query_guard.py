@@ -0,0 +1,262 @@
+# query_guard.py
+# Cost guard in front of query execution. Generated SQL is planned with
+# EXPLAIN before it runs: full scans over large tables get a LIMIT injected
+# (or tightened), cartesian joins whose estimated row combinations are too
+# large are rejected, and every statement runs under a wall-clock timeout so a
+# single runaway query cannot hold a pooled connection for everyone else.
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import text
+from db_engine import connect
+
+GUARD_ENABLED = os.getenv("QUERY_GUARD", "1").lower() not in ("0", "false", "no")
+# a full scan over a table at least this big is flagged and limited
+GUARD_LARGE_TABLE_ROWS = int(os.getenv("GUARD_LARGE_TABLE_ROWS", "100000"))
+# estimated row combinations of a nested loop over full scans above which it is
+# limited, or rejected when nothing ties the tables together (a cartesian join)
+GUARD_MAX_JOIN_ROWS = int(os.getenv("GUARD_MAX_JOIN_ROWS", "10000000"))
+# LIMIT injected into (or tightened on) flagged queries
+GUARD_MAX_ROWS = int(os.getenv("GUARD_MAX_ROWS", "10000"))
+QUERY_TIMEOUT_SECONDS = float(os.getenv("QUERY_TIMEOUT_SECONDS", "15"))
+# table size estimates are cheap but not free; reuse them for a while
+TABLE_STATS_TTL = float(os.getenv("GUARD_TABLE_STATS_TTL", "300"))
+
+_table_rows = {}   # (connection_string, table) -> (rows, fetched_at)
+_lock = threading.Lock()
+
+
+class QueryTimeoutError(Exception):
+    """The statement ran past its wall-clock budget and was cancelled."""
+
+
+def _dialect(conn):
+    return conn.engine.dialect.name
+
+@contextmanager
+def statement_timeout(conn, seconds=QUERY_TIMEOUT_SECONDS):
+    """Cancel whatever `conn` executes inside the block after `seconds`."""
+    if not seconds or seconds <= 0:
+        yield
+        return
+    dialect = _dialect(conn)
+    deadline = time.monotonic() + seconds
+    raw = None
+    if dialect == "sqlite":
+        # the handler runs every N VM instructions; a non-zero return interrupts the query
+        raw = conn.connection.driver_connection
+        raw.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+    elif dialect == "postgresql":
+        # scoped to the connection's transaction, which is rolled back on return to the pool
+        conn.execute(text(f"SET LOCAL statement_timeout = {int(seconds * 1000)}"))
+    elif dialect in ("mysql", "mariadb"):
+        conn.execute(text(f"SET SESSION max_execution_time = {int(seconds * 1000)}"))
+    try:
+        yield
+    except Exception as e:
+        if time.monotonic() > deadline:
+            raise QueryTimeoutError(f"query cancelled after {seconds:g}s (QUERY_TIMEOUT_SECONDS)") from e
+        raise
+    finally:
+        if raw is not None:
+            raw.set_progress_handler(None, 0)
+        elif dialect in ("mysql", "mariadb"):
+            conn.execute(text("SET SESSION max_execution_time = 0"))
+
+
+def _estimate_table_rows(conn, connection_string, table):
+    key = (connection_string, table)
+    cached = _table_rows.get(key)
+    if cached and time.time() - cached[1] < TABLE_STATS_TTL:
+        return cached[0]
+    dialect = _dialect(conn)
+    rows = None
+    try:
+        if dialect == "sqlite":
+            # max(rowid) is a b-tree seek, unlike COUNT(*); close enough for a guard
+            rows = conn.execute(text(f'SELECT MAX(rowid) FROM "{table}"')).scalar() or 0
+        elif dialect == "postgresql":
+            rows = conn.execute(text("SELECT reltuples::bigint FROM pg_class WHERE relname = :t"), {"t": table}).scalar()
+        elif dialect in ("mysql", "mariadb"):
+            rows = conn.execute(text(
+                "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :t"
+            ), {"t": table}).scalar()
+    except Exception:
+        rows = None
+    with _lock:
+        _table_rows[key] = (rows, time.time())
+    return rows
+
+SQL_KEYWORDS = {"where", "join", "inner", "left", "right", "full", "outer", "cross", "on", "group",
+                "order", "limit", "having", "union", "natural", "using", "as"}
+
+def _aliases(sql):
+    # {alias or table name: table} for tables named after FROM / JOIN / a comma in a FROM list
+    found = {}
+    for table, alias in re.findall(r"(?:\bFROM|\bJOIN|,)\s+[\"`\[]?(\w+)[\"`\]]?(?:\s+(?:AS\s+)?(\w+))?", sql, re.IGNORECASE):
+        found[table] = table
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            found[alias] = table
+    return found
+
+# Each inspector returns (scans, loops): every full table scan as (table, rows),
+# and every nested loop over two or more full scans as (tables, row combinations,
+# cartesian), where cartesian is None when the plan does not show whether the
+# loop has a join condition. Scans in different branches of a UNION, in
+# subqueries or under a hash/merge join are not multiplied together.
+
+def _loop(tables_rows, cartesian=None):
+    combined = 1
+    for _, rows in tables_rows:
+        combined *= max(rows, 1)
+    return [t for t, _ in tables_rows], combined, cartesian
+
+def _inspect_sqlite(conn, connection_string, sql):
+    aliases = _aliases(sql)
+    scans = []
+    by_parent = {}
+    for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")):
+        # "SCAN a" / "SCAN TABLE t AS a" / "SCAN t USING COVERING INDEX ix" walk the whole table;
+        # "SEARCH ..." lines are index lookups and cheap. Newer SQLite prints the alias.
+        match = re.match(r"SCAN (?:TABLE (\w+)|(\w+))", row[-1])
+        if not match:
+            continue
+        name = match.group(1) or aliases.get(match.group(2))
+        if name:
+            rows = _estimate_table_rows(conn, connection_string, name)
+            scans.append((name, rows))
+            # scans sharing a parent are loops of the same SELECT, i.e. one nested loop;
+            # an equality join would have shown up as a SEARCH (automatic index) instead
+            if rows is not None:
+                by_parent.setdefault(row[1], []).append((name, rows))
+    return scans, [_loop(group) for group in by_parent.values() if len(group) > 1]
+
+def _inspect_mysql(conn, connection_string, sql):
+    aliases = _aliases(sql)
+    scans = []
+    by_select = {}
+    for row in conn.execute(text(f"EXPLAIN {sql}")).mappings():
+        if str(row.get("type")).upper() == "ALL" and row.get("table"):
+            scan = (aliases.get(row["table"], row["table"]), int(row.get("rows") or 0))
+            scans.append(scan)
+            by_select.setdefault(row.get("id"), []).append(scan)
+    return scans, [_loop(group) for group in by_select.values() if len(group) > 1]
+
+_PARAMETERIZED = ("Index Cond", "Recheck Cond")
+
+def _subtree(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.get("Plans", []))
+
+def _inspect_postgresql(conn, connection_string, sql):
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    plan = plan[0]["Plan"] if isinstance(plan, list) else plan["Plan"]
+    scans = []
+    loops = []
+    for node in _subtree(plan):
+        if node.get("Node Type") == "Seq Scan":
+            scans.append((node.get("Relation Name"), _estimate_table_rows(conn, connection_string, node.get("Relation Name"))))
+        elif node.get("Node Type") == "Nested Loop":
+            tables = [n.get("Relation Name") for n in _subtree(node) if n.get("Node Type") == "Seq Scan"]
+            if len(tables) < 2:
+                continue
+            # no join filter and an inner side that is not an index lookup on the outer row
+            inner = next((n for n in node.get("Plans", []) if n.get("Parent Relationship") == "Inner"), {})
+            cartesian = not node.get("Join Filter") and not any(
+                key in n for n in _subtree(inner) for key in _PARAMETERIZED)
+            loops.append((tables, int(node.get("Plan Rows") or 0), cartesian))
+    return scans, loops
+
+_INSPECTORS = {"sqlite": _inspect_sqlite, "postgresql": _inspect_postgresql, "mysql": _inspect_mysql, "mariadb": _inspect_mysql}
+
+def is_cartesian(sql):
+    # CROSS JOIN, or a comma-separated FROM list with no WHERE clause tying the tables together
+    if re.search(r"\bCROSS\s+JOIN\b", sql, re.IGNORECASE):
+        return True
+    from_list = re.search(r"\bFROM\s+(.*?)(?:\bWHERE\b|\bGROUP\b|\bORDER\b|\bLIMIT\b|\bHAVING\b|\bJOIN\b|$)",
+                          sql, re.IGNORECASE | re.DOTALL)
+    return bool(from_list and "," in from_list.group(1) and "(" not in from_list.group(1)
+                and not re.search(r"\bWHERE\b", sql, re.IGNORECASE))
+
+# quoted literals/identifiers (kept) or comments (dropped)
+_LITERAL_OR_COMMENT = re.compile(r"('(?:[^']|'')*'|\"[^\"]*\"|`[^`]*`)|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+def strip_comments(sql):
+    # a trailing "-- ..." would swallow anything appended to the statement
+    return _LITERAL_OR_COMMENT.sub(lambda m: m.group(1) or " ", sql)
+
+# simple safety check (use sqlparse for robust parsing)
+def is_safe_select(sql_text: str) -> bool:
+    s = sql_text.strip().lower()
+    # quick guard: allow only statements that start with SELECT
+    return s.startswith("select")
+
+def apply_limit(sql, max_rows=GUARD_MAX_ROWS):
+    """sql with a trailing LIMIT of at most max_rows (added if missing)."""
+    sql = strip_comments(sql).strip().rstrip(";").rstrip()
+    match = re.search(r"\bLIMIT\s+(\d+)(?:\s*,\s*(\d+))?(\s+OFFSET\s+\d+)?\s*$", sql, re.IGNORECASE)
+    if not match:
+        return f"{sql} LIMIT {max_rows}"
+    if match.group(2):
+        # MySQL "LIMIT offset, count"
+        count = min(int(match.group(2)), max_rows)
+        return f"{sql[:match.start()]}LIMIT {match.group(1)}, {count}"
+    count = min(int(match.group(1)), max_rows)
+    return f"{sql[:match.start()]}LIMIT {count}{match.group(3) or ''}"
+
+def guard_sql(connection_string, sql, max_rows=GUARD_MAX_ROWS):
+    """
+    Plan the query and decide whether it may run.
+
+    Returns a dict with the "action" ("allowed", "limited" or "rejected"), the
+    "sql" to execute (rewritten when limited), the "reasons", the largest
+    "estimated_rows" any scan or nested loop in the plan produces and "elapsed_ms".
+    """
+    start = time.perf_counter()
+    report = {"action": "allowed", "sql": sql, "original_sql": sql, "reasons": [], "estimated_rows": None}
+    if not GUARD_ENABLED:
+        report["elapsed_ms"] = 0.0
+        return report
+    statement = strip_comments(sql).strip().rstrip(";").rstrip()
+    scans, loops = [], []
+    try:
+        with connect(connection_string) as conn:
+            inspector = _INSPECTORS.get(_dialect(conn))
+            if inspector:
+                scans, loops = inspector(conn, connection_string, statement)
+    except Exception:
+        # a query the database cannot plan fails at execution and goes through self-heal
+        scans, loops = [], []
+
+    cartesian_sql = is_cartesian(statement)
+    known = [(table, rows) for table, rows in scans if rows is not None]
+    for table, rows in known:
+        if rows >= GUARD_LARGE_TABLE_ROWS:
+            report["reasons"].append(f"full scan of {table} (~{rows} rows)")
+    for tables, combined, cartesian in loops:
+        if combined <= GUARD_MAX_JOIN_ROWS:
+            continue
+        if cartesian is None:
+            cartesian = cartesian_sql
+        if cartesian:
+            report["reasons"].append(f"cartesian join over full scans of {', '.join(tables)} (~{combined} row combinations)")
+            report["action"] = "rejected"
+        else:
+            report["reasons"].append(f"nested loop over full scans of {', '.join(tables)} (~{combined} row combinations)")
+    estimates = [rows for _, rows in known] + [combined for _, combined, _ in loops]
+    if estimates:
+        report["estimated_rows"] = max(estimates)
+    if cartesian_sql:
+        report["reasons"].append("cartesian join (no join condition)")
+
+    if report["reasons"] and report["action"] != "rejected":
+        limited = apply_limit(statement, max_rows)
+        if limited != statement:
+            report.update(action="limited", sql=limited)
+    report["elapsed_ms"] = (time.perf_counter() - start) * 1000
+    return report
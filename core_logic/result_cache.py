@@ -0,0 +1,133 @@
+# result_cache.py
+# Caches executed SELECT results keyed by (connection, canonical SQL) and the
+# data version they were read at. SQLite entries are checked against
+# PRAGMA data_version, which moves on every commit from any other connection,
+# so a write is never answered from the cache; other dialects fall back to a
+# TTL. The cache is an LRU bounded by the estimated size of the results in bytes.
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.compiler import RESERVED_WORDS
+
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# seconds; only for databases without a cheap data-version token
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "60"))
+
+# folded to lower case; identifiers keep theirs, since unquoted table names are
+# case-sensitive on some databases (MySQL on Linux): FROM Users is not FROM users
+SQL_KEYWORDS = RESERVED_WORDS | {"by", "count", "sum", "avg", "min", "max", "offset", "coalesce"}
+
+def _fold_keywords(text):
+    return re.sub(r"[A-Za-z_]\w*", lambda m: m.group(0).lower() if m.group(0).lower() in SQL_KEYWORDS else m.group(0), text)
+
+def canonical_sql(sql):
+    # collapse whitespace and keyword case outside quoted literals/identifiers, drop the trailing ';'
+    parts = re.split(r"('(?:[^']|'')*'|\"[^\"]*\"|`[^`]*`)", sql.strip().rstrip(";"))
+    return "".join(p if i % 2 else _fold_keywords(re.sub(r"\s+", " ", p)) for i, p in enumerate(parts)).strip()
+
+def _sizeof(value):
+    # rough deep size of a result: containers plus their scalar items
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # connection_string -> dedicated sqlite3 connection used only to read data_version
+        self._watchers = {}
+        self._watch_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def data_version(self, connection_string):
+        """Opaque token that changes whenever the data may have changed; None if unknown."""
+        url = make_url(connection_string)
+        if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+            return None
+        with self._watch_lock:
+            watcher = self._watchers.get(connection_string)
+            if watcher is None:
+                # data_version only moves for commits made by *other* connections,
+                # so this one never writes; it just watches
+                watcher = sqlite3.connect(url.database, check_same_thread=False)
+                self._watchers[connection_string] = watcher
+            return watcher.execute("PRAGMA data_version").fetchone()[0]
+
+    def _fresh(self, entry, version):
+        if entry["version"] is not None:
+            return entry["version"] == version
+        return not self.ttl or time.monotonic() - entry["stored_at"] <= self.ttl
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["bytes"]
+
+    def get(self, connection_string, sql, variant=()):
+        key = (connection_string, canonical_sql(sql), variant)
+        version = self.data_version(connection_string)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if not self._fresh(entry, version):
+                self._drop(key)
+                self.stale += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["result"]
+
+    def put(self, connection_string, sql, result, version, variant=()):
+        # version: data_version() read *before* the query ran, so a write that
+        # lands during execution makes this entry stale instead of hiding it
+        key = (connection_string, canonical_sql(sql), variant)
+        size = _sizeof(result) + _sizeof(key)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {"result": result, "version": version, "bytes": size, "stored_at": time.monotonic()}
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self, connection_string=None):
+        with self._lock:
+            for key in [k for k in self._entries if connection_string in (None, k[0])]:
+                self._drop(key)
+        with self._watch_lock:
+            for url in [u for u in self._watchers if connection_string in (None, u)]:
+                self._watchers.pop(url).close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions
+            }
+
+
+result_cache = ResultCache()
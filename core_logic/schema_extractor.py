@@ -1,10 +1,67 @@
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+from db_engine import get_engine, connect
+import hashlib
+import json
+import os
 
-def extract_schema(connection_string):
-    engine = create_engine(connection_string)
+SCHEMA_CACHE_DIR = os.getenv("SCHEMA_CACHE_DIR", "schema_cache")
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def _cache_path(connection_string):
+    key = hashlib.sha256(connection_string.encode("utf-8")).hexdigest()[:24]
+    return os.path.join(SCHEMA_CACHE_DIR, f"{key}.json")
+
+def _load_cache(connection_string):
+    try:
+        with open(_cache_path(connection_string), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_cache(connection_string, entry):
+    os.makedirs(SCHEMA_CACHE_DIR, exist_ok=True)
+    path = _cache_path(connection_string)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+
+def _table_tokens(conn, engine):
+    # one catalog query -> {table: checksum of its definition}
+    if engine.dialect.name == "sqlite":
+        rows = conn.execute(text(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        ))
+        return {name: _digest(sql) for name, sql in rows}
+    try:
+        schema_name = engine.dialect.default_schema_name
+        columns = conn.execute(text(
+            "SELECT table_name, column_name, data_type, ordinal_position FROM information_schema.columns "
+            "WHERE table_schema = :schema"
+        ), {"schema": schema_name}).fetchall()
+        constraints = conn.execute(text(
+            "SELECT table_name, constraint_name FROM information_schema.table_constraints "
+            "WHERE table_schema = :schema AND constraint_type = 'FOREIGN KEY'"
+        ), {"schema": schema_name}).fetchall()
+    except SQLAlchemyError:
+        # catalog not queryable this way; caller falls back to full inspection
+        return None
+    per_table = {}
+    for table_name, *rest in sorted(columns, key=lambda r: (r[0], r[3])):
+        per_table.setdefault(table_name, []).append(list(rest))
+    for table_name, constraint_name in sorted(constraints):
+        per_table.setdefault(table_name, []).append(["fk", constraint_name])
+    return {name: _digest(parts) for name, parts in per_table.items()}
+
+def _inspect_tables(engine, table_names):
     inspector = inspect(engine)
+    if table_names is None:
+        table_names = inspector.get_table_names()
     schema = []
-    for table_name in inspector.get_table_names():
+    for table_name in table_names:
         columns = inspector.get_columns(table_name)
         column_info = [f"{col['name']} {str(col['type'])}" for col in columns]
         fks = inspector.get_foreign_keys(table_name)
@@ -16,6 +73,49 @@ def extract_schema(connection_string):
         })
     return schema
 
+def _extract(connection_string, use_cache=True):
+    engine = get_engine(connection_string)
+    if not use_cache:
+        schema = _inspect_tables(engine, None)
+        return {"version": None, "schema": schema, "schema_text": render_schema_text(schema)}
+
+    cache = _load_cache(connection_string)
+    with connect(connection_string) as conn:
+        tokens = _table_tokens(conn, engine)
+    # the catalog checksum is the version; sqlite's PRAGMA schema_version is a
+    # per-file DDL counter, so a recreated file at the same path could match it
+    version = _digest(tokens) if tokens is not None else None
+    if cache and version is not None and cache.get("version") == version:
+        return cache
+
+    if tokens is None:
+        schema = _inspect_tables(engine, None)
+        return {"version": None, "schema": schema, "schema_text": render_schema_text(schema)}
+
+    # re-inspect only tables that are new or whose definition changed
+    old_tables = {t["table"]: t for t in cache["schema"]} if cache else {}
+    old_tokens = cache.get("tokens", {}) if cache else {}
+    changed = [name for name in sorted(tokens) if name not in old_tables or old_tokens.get(name) != tokens[name]]
+    fresh = {t["table"]: t for t in _inspect_tables(engine, changed)}
+    schema = [fresh.get(name) or old_tables[name] for name in sorted(tokens)]
+
+    entry = {
+        "version": version,
+        "tokens": tokens,
+        "schema": schema,
+        "schema_text": render_schema_text(schema)
+    }
+    _save_cache(connection_string, entry)
+    return entry
+
+def extract_schema(connection_string, use_cache=True):
+    return _extract(connection_string, use_cache)["schema"]
+
+def load_schema(connection_string, use_cache=True):
+    # (schema, rendered schema text), both straight from the cache when nothing changed
+    entry = _extract(connection_string, use_cache)
+    return entry["schema"], entry["schema_text"]
+
 def render_schema_text(schema):
     lines = []
     for table in schema:
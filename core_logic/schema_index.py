@@ -0,0 +1,143 @@
+# schema_index.py
+# In-process schema retrieval built from extract_schema output. A BM25 index
+# over table and column names answers most questions locally in well under a
+# millisecond; the chroma vector search is only consulted when the question
+# shares no vocabulary with the schema (or always, if configured), and the two
+# rankings are fused. Hits are then expanded along the foreign-key graph so
+# join tables come along, and the context is trimmed to a token budget.
+import heapq
+import math
+import os
+import re
+from collections import Counter
+from schema_extractor import render_schema_text
+from session_memory import estimate_tokens
+
+SCHEMA_INDEX_TOP_K = int(os.getenv("SCHEMA_INDEX_TOP_K", "3"))
+# rough token budget for the schema context handed to the agent
+SCHEMA_CONTEXT_TOKENS = int(os.getenv("SCHEMA_CONTEXT_TOKENS", "1500"))
+# "fallback": vector search only when BM25 finds nothing; "always": fuse both; "never": BM25 only
+SCHEMA_VECTOR_MODE = os.getenv("SCHEMA_VECTOR_MODE", "fallback")
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+# reciprocal rank fusion constant; 60 is the usual choice
+RRF_K = 60
+
+STOPWORDS = {
+    "a", "an", "the", "of", "in", "on", "for", "to", "by", "with", "and", "or", "is", "are", "was",
+    "were", "be", "what", "which", "who", "whom", "how", "many", "much", "me", "show", "list", "give",
+    "get", "find", "all", "each", "per", "from", "that", "this", "there", "their", "do", "does", "did",
+    "have", "has", "most", "than", "more", "less", "at", "as", "it", "its", "any"
+}
+
+def _stem(token):
+    # plural folding is enough to match "employees" to an employee table
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+def tokenize(text):
+    # split snake_case and camelCase identifiers as well as prose
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    return [_stem(t) for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in STOPWORDS]
+
+
+class SchemaIndex:
+    def __init__(self, schema, collection=None, vector_mode=SCHEMA_VECTOR_MODE):
+        self.collection = collection
+        self.vector_mode = vector_mode
+        self.chunks = {}
+        self.neighbors = {}
+        postings = {}
+        lengths = {}
+        references = []
+        for table in schema:
+            name = table["table"]
+            self.chunks[name] = render_schema_text([table]).strip()
+            # the table name counts twice: "orders" should rank the orders table above order_id columns
+            terms = tokenize(name) * 2
+            for column in table["columns"]:
+                terms += tokenize(column.split()[0]) if column.strip() else []
+            lengths[name] = len(terms)
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, {})[name] = tf
+            for fk in table["foreign_keys"]:
+                match = re.search(r"REFERENCES\s+(\w+)", fk)
+                if match:
+                    references.append((name, match.group(1)))
+        for name, referred in references:
+            # an FK may point outside the extracted schema (another schema, or a
+            # table SQLite never checks for); there is no chunk to add for it
+            if referred in self.chunks:
+                self.neighbors.setdefault(name, set()).add(referred)
+                self.neighbors.setdefault(referred, set()).add(name)
+        # BM25 term weights are fixed per (term, table), so compute them once here
+        n = len(lengths) or 1
+        avg_length = (sum(lengths.values()) / n) or 1
+        self._weights = {}
+        for term, docs in postings.items():
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            self._weights[term] = {
+                table: idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths[table] / avg_length))
+                for table, tf in docs.items()
+            }
+        self.stats = {"lexical": 0, "vector": 0}
+
+    def lexical(self, question, k):
+        scores = {}
+        for term in set(tokenize(question)):
+            for table, weight in self._weights.get(term, {}).items():
+                scores[table] = scores.get(table, 0.0) + weight
+        return heapq.nlargest(k, scores, key=scores.get)
+
+    def vector(self, question, k):
+        from vector_store import query_schema_store
+        tables = []
+        for doc in query_schema_store(self.collection, question, k=min(k, len(self.chunks)) or 1):
+            match = re.match(r"Table: (\w+)", doc.strip())
+            if match and match.group(1) in self.chunks:
+                tables.append(match.group(1))
+        return tables
+
+    def rank(self, question, k=SCHEMA_INDEX_TOP_K):
+        ranked = self.lexical(question, k)
+        use_vector = self.collection is not None and (
+            self.vector_mode == "always" or (self.vector_mode == "fallback" and not ranked))
+        if not use_vector:
+            self.stats["lexical"] += 1
+            return ranked[:k]
+        self.stats["vector"] += 1
+        fused = {}
+        for ranking in (ranked, self.vector(question, k)):
+            for position, table in enumerate(ranking):
+                fused[table] = fused.get(table, 0.0) + 1.0 / (RRF_K + position + 1)
+        return sorted(fused, key=fused.get, reverse=True)[:k]
+
+    def expand(self, tables):
+        # hits first, then tables that bridge two hits (join tables), then other FK neighbours
+        hits = set(tables)
+        bridges, neighbours = [], []
+        for table in tables:
+            for other in sorted(self.neighbors.get(table, ())):
+                if other in hits or other in bridges or other in neighbours:
+                    continue
+                if len(self.neighbors.get(other, set()) & hits) > 1:
+                    bridges.append(other)
+                else:
+                    neighbours.append(other)
+        return list(tables) + bridges + neighbours
+
+    def search(self, question, k=SCHEMA_INDEX_TOP_K, token_budget=SCHEMA_CONTEXT_TOKENS):
+        """Schema chunks for the question, best first, within token_budget (at least one chunk)."""
+        chunks = []
+        used = 0
+        for table in self.expand(self.rank(question, k)):
+            cost = estimate_tokens(self.chunks[table])
+            if chunks and used + cost > token_budget:
+                continue
+            chunks.append(self.chunks[table])
+            used += cost
+        return chunks
@@ -1,48 +1,139 @@
-import chromadb
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 from dotenv import load_dotenv
-import os, json
+from embeddings import get_embedder
+from query_cache import schema_fingerprint
+from llm_gateway import gateway
+import hashlib
+import os, json, re, threading, time
 
 load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API")
-EMBED_MODEL = GoogleGenerativeAIEmbeddings(
-    model="models/embedding-001",
-    google_api_key=GOOGLE_API_KEY
-)
 
-client = chromadb.PersistentClient(path="error_pattern_db")
-collection = client.get_or_create_collection(name="error_memory")
+# evict least-used patterns once the store grows past this many records
+ERROR_STORE_MAX = int(os.getenv("ERROR_STORE_MAX", "5000"))
+
+_collection = None
+_collection_lock = threading.Lock()
+
+def get_collection():
+    # chromadb is slow to import and open; defer it to the first error (or the warm-up)
+    global _collection
+    with _collection_lock:
+        if _collection is None:
+            import chromadb
+            client = chromadb.PersistentClient(path="error_pattern_db")
+            _collection = client.get_or_create_collection(name="error_signatures")
+        return _collection
+
+# (kind, pattern) over the driver error text; group 1 is the offending identifier
+ERROR_PATTERNS = [
+    ("column", r"no such column:\s*([\w.\"`\[\]]+)"),
+    ("column", r"column \"?([\w.]+)\"? does not exist"),
+    ("column", r"Unknown column '([\w.]+)'"),
+    ("column", r"Invalid column name '([\w.]+)'"),
+    ("table", r"no such table:\s*([\w.\"`\[\]]+)"),
+    ("table", r"relation \"?([\w.]+)\"? does not exist"),
+    ("table", r"Table '(?:\w+\.)?(\w+)' doesn't exist"),
+    ("table", r"Invalid object name '([\w.]+)'"),
+    ("ambiguous", r"ambiguous column name:\s*([\w.]+)"),
+    ("ambiguous", r"column reference \"?(\w+)\"? is ambiguous"),
+    ("ambiguous", r"Column '(\w+)' in [\w ]+ is ambiguous"),
+]
+
+def classify_error(error):
+    for kind, pattern in ERROR_PATTERNS:
+        match = re.search(pattern, error, re.IGNORECASE)
+        if match:
+            return kind, match.group(1).strip("\"`[]")
+    return None, None
+
+def normalize_error(error):
+    # driver message only: no echoed SQL, no doc links, no literal values
+    message = error.split("\n")[0]
+    message = re.sub(r"^\([\w.]+\)\s*", "", message)
+    message = re.sub(r"'[^']*'|\"[^\"]*\"|\b\d+\b", "?", message)
+    return re.sub(r"\s+", " ", message).strip().lower()[:200]
+
+def error_signature(sql, error, schema):
+    kind, ident = classify_error(error)
+    tables = re.findall(r"\b(?:FROM|JOIN)\s+[\"`\[]?(\w+)", sql, re.IGNORECASE)
+    identifiers = sorted({t.lower() for t in tables} | ({ident.lower()} if ident else set()))
+    return {
+        "error_class": kind or normalize_error(error),
+        "identifiers": identifiers,
+        "schema_fingerprint": schema_fingerprint(schema)
+    }
+
+def signature_id(signature):
+    # stable across processes, unlike hash(); the same pattern always maps to one record
+    raw = json.dumps(signature, sort_keys=True).encode("utf-8")
+    return "err_" + hashlib.sha256(raw).hexdigest()[:24]
 
 def vectorize_error(schema, sql, error, context=""):
-    text = f"SCHEMA:\n{schema}\n\nSQL:\n{sql}\n\nERROR:\n{error}\nCONTEXT:\n{context}"
-    return EMBED_MODEL.embed_query(text), text
+    signature = error_signature(sql, error, schema)
+    text = f"ERROR: {signature['error_class']}\nIDENTIFIERS: {', '.join(signature['identifiers'])}\nCONTEXT: {context}"
+    return signature, text
 
 def store_error_pattern(schema, sql, error, context, fix_sql):
-    embedding, text = vectorize_error(schema, sql, error, context)
-    doc_id = f"err_{abs(hash(text)) % (10**12)}"
-    collection.add(
-        ids=[doc_id],
-        embeddings=[embedding],
+    signature, text = vectorize_error(schema, sql, error, context)
+    get_collection().upsert(
+        ids=[signature_id(signature)],
+        embeddings=[get_embedder().embed_query(text)],
         documents=[text],
         metadatas=[{
-            "schema": schema,
             "sql": sql,
-            "error": error,
+            "error": normalize_error(error),
+            "error_class": signature["error_class"],
+            "identifiers": ",".join(signature["identifiers"]),
+            "schema_fingerprint": signature["schema_fingerprint"],
             "context": context,
-            "fix_sql": fix_sql
+            "fix_sql": fix_sql,
+            "hits": 0,
+            "last_used": time.time()
         }]
     )
+    evict_error_patterns()
+
+def _touch(doc_id, meta):
+    meta = dict(meta, hits=int(meta.get("hits", 0)) + 1, last_used=time.time())
+    get_collection().update(ids=[doc_id], metadatas=[meta])
+    return meta
 
 def search_similar_errors(schema, sql, error, context="", top_k=3):
-    embedding, _ = vectorize_error(schema, sql, error, context)
-    results = collection.query(query_embeddings=[embedding], n_results=top_k)
+    signature, text = vectorize_error(schema, sql, error, context)
+    # exact signature match: no embedding call, no vector search
+    doc_id = signature_id(signature)
+    collection = get_collection()
+    exact = collection.get(ids=[doc_id], include=["documents", "metadatas"])
+    if exact["ids"]:
+        meta = _touch(doc_id, exact["metadatas"][0])
+        return [{"text": exact["documents"][0], "meta": meta, "exact": True}]
+
+    if collection.count() == 0:
+        return []
+    results = collection.query(query_embeddings=[get_embedder().embed_query(text)], n_results=top_k)
     found = []
     for doc, meta in zip(results['documents'][0], results['metadatas'][0]):
-        found.append({"text": doc, "meta": meta})
+        found.append({"text": doc, "meta": meta, "exact": False})
+    if found:
+        found[0]["meta"] = _touch(results['ids'][0][0], found[0]["meta"])
     return found
 
+def evict_error_patterns(max_records=ERROR_STORE_MAX):
+    collection = get_collection()
+    count = collection.count()
+    if count <= max_records:
+        return 0
+    # trim to 90% so eviction runs once per batch of inserts, not on every insert
+    target = int(max_records * 0.9)
+    records = collection.get(include=["metadatas"])
+    ranked = sorted(
+        zip(records["ids"], records["metadatas"]),
+        key=lambda item: (int(item[1].get("hits", 0)), float(item[1].get("last_used", 0)))
+    )
+    stale = [doc_id for doc_id, _ in ranked[:count - target]]
+    collection.delete(ids=stale)
+    return len(stale)
+
 def prompt_gemini_with_error(schema, sql, error, context, similar_case=None):
-    llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=GOOGLE_API_KEY)
     prompt = f"""
 You are a SQL expert agent. A query failed.
 Current SCHEMA:
@@ -53,7 +144,6 @@ ERROR:
 {error}
 """
     if similar_case:
-        prompt += f"\nA similar error previously occurred:\n---\nPREVIOUS SCHEMA:\n{similar_case['schema']}\nFAILED SQL:\n{similar_case['sql']}\nERROR:\n{similar_case['error']}\nPREVIOUS FIX SQL:\n{similar_case.get('fix_sql', '')}\n---\n"
+        prompt += f"\nA similar error previously occurred:\n---\nFAILED SQL:\n{similar_case.get('sql', '')}\nERROR:\n{similar_case.get('error', '')}\nPREVIOUS FIX SQL:\n{similar_case.get('fix_sql', '')}\n---\n"
     prompt += "\nUsing all context, suggest a corrected SQL. Output only SQL."
-    result = llm.invoke(prompt)
-    return result['content'] if isinstance(result, dict) and 'content' in result else str(result)
+    return gateway.invoke(prompt)
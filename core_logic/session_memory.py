@@ -0,0 +1,97 @@
+# session_memory.py
+# Per-session conversation history for the agent. Each session keeps only the
+# most recent turns that fit its token budget, and idle sessions are evicted
+# (TTL, then LRU) so memory per process stays flat under sustained traffic.
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from langchain_core.messages import HumanMessage, AIMessage
+
+SESSION_TOKEN_BUDGET = int(os.getenv("SESSION_TOKEN_BUDGET", "2000"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+
+def estimate_tokens(text):
+    # ~4 characters per token; good enough for budgeting without a tokenizer call
+    return len(text) // 4 + 1
+
+
+class SessionHistory:
+    def __init__(self, token_budget=SESSION_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self.turns = deque()
+        self.tokens = 0
+        self.dropped_turns = 0
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add_turn(self, question, answer):
+        answer = str(answer)
+        cost = estimate_tokens(question) + estimate_tokens(answer)
+        with self.lock:
+            self.turns.append((question, answer, cost))
+            self.tokens += cost
+            # window: drop the oldest turns, but always keep the latest one
+            while self.tokens > self.token_budget and len(self.turns) > 1:
+                _, _, old_cost = self.turns.popleft()
+                self.tokens -= old_cost
+                self.dropped_turns += 1
+
+    def messages(self):
+        with self.lock:
+            history = []
+            for question, answer, _ in self.turns:
+                history.append(HumanMessage(content=question))
+                history.append(AIMessage(content=answer))
+            return history
+
+    def is_empty(self):
+        return not self.turns
+
+
+class SessionStore:
+    def __init__(self, max_sessions=SESSION_MAX, ttl=SESSION_TTL, token_budget=SESSION_TOKEN_BUDGET):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _evict(self, now):
+        # caller holds self._lock; oldest-used sessions sit at the front
+        while self._sessions:
+            session_id, history = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or (self.ttl and now - history.last_used > self.ttl):
+                del self._sessions[session_id]
+                self.evicted += 1
+            else:
+                break
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            history = self._sessions.get(session_id)
+            if history is None or (self.ttl and now - history.last_used > self.ttl):
+                history = SessionHistory(self.token_budget)
+                self._sessions[session_id] = history
+            history.last_used = now
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+            return history
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "evicted": self.evicted,
+                "history_tokens": sum(h.tokens for h in self._sessions.values())
+            }
+
+
+session_store = SessionStore()
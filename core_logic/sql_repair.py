@@ -0,0 +1,155 @@
+# sql_repair.py
+# Tiered self-healing for failed SQL. A local, rule-based pass fixes the
+# common trivial failures (misspelled or wrongly-cased table/column names,
+# ambiguous columns in joins) against the extracted schema and revalidates
+# with EXPLAIN; only if that fails do we pay for the vector search + LLM loop.
+import difflib
+import os
+import re
+import time
+from sqlalchemy import text
+from db_engine import connect
+from self_healing_vector_db import classify_error, store_error_pattern, search_similar_errors, prompt_gemini_with_error
+
+SELF_HEAL_MAX_ROUNDS = int(os.getenv("SELF_HEAL_MAX_ROUNDS", "3"))
+LOCAL_REPAIR_MAX_FIXES = int(os.getenv("LOCAL_REPAIR_MAX_FIXES", "5"))
+FUZZY_CUTOFF = float(os.getenv("REPAIR_FUZZY_CUTOFF", "0.75"))
+
+SQL_KEYWORDS = {
+    "where", "join", "inner", "left", "right", "full", "outer", "cross", "on", "group",
+    "order", "limit", "having", "union", "natural", "using", "offset", "as"
+}
+
+def _schema_maps(schema):
+    # {table: [column names]} from extract_schema output ("name TYPE" strings)
+    return {t["table"]: [c.split()[0] for c in t["columns"] if c.strip()] for t in schema}
+
+def _referenced_tables(sql, tables):
+    """[(table, alias)] for tables named after FROM/JOIN, in query order."""
+    lookup = {t.lower(): t for t in tables}
+    found = []
+    for name, alias in re.findall(r"\b(?:FROM|JOIN)\s+[\"`\[]?(\w+)[\"`\]]?(?:\s+(?:AS\s+)?(\w+))?", sql, re.IGNORECASE):
+        if alias and alias.lower() in SQL_KEYWORDS:
+            alias = ""
+        table = lookup.get(name.lower(), name)
+        found.append((table, alias or name))
+    return found
+
+def _closest(name, candidates):
+    by_lower = {c.lower(): c for c in candidates}
+    if name.lower() in by_lower:
+        return by_lower[name.lower()]
+    match = difflib.get_close_matches(name.lower(), list(by_lower), n=1, cutoff=FUZZY_CUTOFF)
+    return by_lower[match[0]] if match else None
+
+def _replace_outside_literals(sql, pattern, repl):
+    # never touch string literals: a value like 'Smith' must stay as written
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    return "".join(p if i % 2 else re.sub(pattern, repl, p, flags=re.IGNORECASE) for i, p in enumerate(parts))
+
+def _fix_once(sql, error, schema_map):
+    kind, ident = classify_error(error)
+    if kind is None:
+        return None
+    referenced = _referenced_tables(sql, schema_map)
+
+    if kind == "table":
+        name = ident.split(".")[-1]
+        target = _closest(name, schema_map)
+        if not target or target == name:
+            return None
+        return _replace_outside_literals(sql, rf"(?<![\w.])[\"`\[]?{re.escape(name)}[\"`\]]?(?!\w)", target)
+
+    if kind == "column":
+        qualifier, _, name = ident.rpartition(".")
+        aliases = {alias.lower(): table for table, alias in referenced}
+        if qualifier and qualifier.lower() in aliases:
+            candidates = schema_map.get(aliases[qualifier.lower()], [])
+        else:
+            candidates = [c for table, _ in referenced for c in schema_map.get(table, [])]
+        candidates = candidates or [c for cols in schema_map.values() for c in cols]
+        target = _closest(name, candidates)
+        if not target or target == name:
+            return None
+        if qualifier:
+            pattern = rf"(?<![\w.]){re.escape(qualifier)}\.[\"`\[]?{re.escape(name)}[\"`\]]?(?!\w)"
+            return _replace_outside_literals(sql, pattern, f"{qualifier}.{target}")
+        return _replace_outside_literals(sql, rf"(?<![\w.])[\"`\[]?{re.escape(name)}[\"`\]]?(?!\w)", target)
+
+    if kind == "ambiguous":
+        owners = [alias for table, alias in referenced
+                  if ident.lower() in (c.lower() for c in schema_map.get(table, []))]
+        if not owners:
+            return None
+        # qualify bare uses with the first (driving) table that has the column
+        return _replace_outside_literals(sql, rf"(?<![\w.]){re.escape(ident)}(?![\w(])", f"{owners[0]}.{ident}")
+    return None
+
+def explain_error(connection_string, sql):
+    """None if the database can plan the query, else the error text."""
+    try:
+        with connect(connection_string) as conn:
+            conn.execute(text(f"EXPLAIN {sql.strip().rstrip(';')}")).fetchall()
+        return None
+    except Exception as e:
+        return str(e)
+
+def local_repair(connection_string, schema, sql, error, max_fixes=LOCAL_REPAIR_MAX_FIXES):
+    # apply one fix per reported error until EXPLAIN accepts the query
+    schema_map = _schema_maps(schema)
+    current = sql
+    for _ in range(max_fixes):
+        fixed = _fix_once(current, error, schema_map)
+        if not fixed or fixed == current:
+            return None
+        current = fixed
+        error = explain_error(connection_string, current)
+        if error is None:
+            return current
+    return None
+
+def strip_sql_fences(reply):
+    match = re.search(r"```(?:sql)?\s*(.*?)```", reply or "", re.DOTALL | re.IGNORECASE)
+    return (match.group(1) if match else reply or "").strip()
+
+def heal_sql(connection_string, schema, schema_text, sql, error, question="", is_safe=None,
+             max_rounds=SELF_HEAL_MAX_ROUNDS):
+    """
+    Try the local repair tier, then up to max_rounds of vector-memory + LLM repair.
+
+    Returns a dict with the fixed "sql" (None if nothing worked), the "tier" that
+    produced it ("local" or "llm"), the LLM "rounds" used and "elapsed_ms".
+    """
+    start = time.perf_counter()
+    report = {"sql": None, "tier": None, "rounds": 0, "suggestion": None, "error": error}
+
+    fixed = local_repair(connection_string, schema, sql, error)
+    if fixed:
+        report.update(sql=fixed, tier="local")
+        report["elapsed_ms"] = (time.perf_counter() - start) * 1000
+        return report
+
+    sim_errors = search_similar_errors(schema_text, sql, error, question)
+    best_case = sim_errors[0]['meta'] if sim_errors else None
+    current_sql, current_error = sql, error
+    for round_no in range(1, max_rounds + 1):
+        report["rounds"] = round_no
+        suggestion = strip_sql_fences(prompt_gemini_with_error(schema_text, current_sql, current_error, question, best_case))
+        report["suggestion"] = suggestion
+        if not suggestion or (is_safe and not is_safe(suggestion)):
+            break
+        new_error = explain_error(connection_string, suggestion)
+        if new_error is not None:
+            # the LLM's fix may itself be one typo away from working
+            locally_fixed = local_repair(connection_string, schema, suggestion, new_error)
+            if locally_fixed:
+                suggestion, new_error = locally_fixed, None
+        if new_error is None:
+            store_error_pattern(schema_text, sql, error, question, suggestion)
+            report.update(sql=suggestion, tier="llm", error=None)
+            break
+        current_sql, current_error = suggestion, new_error
+        report["error"] = new_error
+
+    report["elapsed_ms"] = (time.perf_counter() - start) * 1000
+    return report
@@ -0,0 +1,210 @@
+# tenants.py
+# One process serving many databases. Each tenant (a name mapped to a
+# connection string) has its own engine pool, schema (with its on-disk schema
+# cache), namespaced vector collection, schema index and agent. A tenant is
+# loaded on first use; once more than TENANT_MAX_LOADED are resident, the least
+# recently used idle one is unloaded and its engine pool and cached results freed.
+#
+#   TENANT_DATABASES="employee=sqlite:///employee.db,student=sqlite:///student.db"
+#   (or a JSON object of the same); DATABASE_URL is always served as "default"
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from schema_extractor import load_schema
+from vector_store import create_schema_store
+from schema_index import SchemaIndex
+from agent_runner import build_agent
+from db_engine import reload_engine, dispose_engine
+from query_cache import question_cache, schema_fingerprint
+from result_cache import result_cache
+from session_memory import session_store
+from self_healing_vector_db import get_collection as get_error_store
+from warmup import Warmup
+
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+# loaded tenants kept in memory; tenants serving a request are never evicted
+TENANT_MAX_LOADED = int(os.getenv("TENANT_MAX_LOADED", "8"))
+
+
+class UnknownTenantError(KeyError):
+    """The request named a database that is not configured."""
+
+
+def parse_databases(spec):
+    """{name: connection_string} from "name=url,name=url" or a JSON object."""
+    spec = (spec or "").strip()
+    if spec.startswith("{"):
+        return {str(k): str(v) for k, v in json.loads(spec).items()}
+    databases = {}
+    for item in spec.split(","):
+        name, sep, url = item.partition("=")
+        if sep and name.strip() and url.strip():
+            databases[name.strip()] = url.strip()
+    return databases
+
+def configured_databases(default_url):
+    databases = parse_databases(os.getenv("TENANT_DATABASES"))
+    databases.setdefault(DEFAULT_TENANT, default_url)
+    return databases
+
+def collection_name(name, connection_string):
+    # chroma names: 3-63 chars of [a-zA-Z0-9._-]; the URL digest keeps two
+    # databases apart even if a tenant name is reused for a different URL
+    slug = re.sub(r"[^a-zA-Z0-9_-]", "_", name)[:40]
+    return f"schema_{slug}_{hashlib.sha256(connection_string.encode('utf-8')).hexdigest()[:12]}"
+
+
+class Tenant:
+    """Everything needed to answer questions against one database, loaded on first use."""
+
+    def __init__(self, name, connection_string):
+        self.name = name
+        self.connection_string = connection_string
+        self.collection_name = collection_name(name, connection_string)
+        self.schema = []
+        self.schema_text = ""
+        self.fingerprint = None
+        self.collection = None
+        self.index = None
+        self.agent = None
+        # requests currently using the tenant; see TenantRegistry.use
+        self.active = 0
+        self.last_used = time.monotonic()
+        self.warmup = Warmup([
+            ("schema", self.load_schema),
+            ("schema_store", self.load_schema_store),
+            ("agent", self.load_agent),
+            # shared by every tenant; only the first one pays for it
+            ("error_store", get_error_store)
+        ])
+
+    def load_schema(self):
+        self.schema, self.schema_text = load_schema(self.connection_string)
+        self.fingerprint = schema_fingerprint(self.schema_text)
+
+    def load_schema_store(self):
+        self.collection = create_schema_store(self.schema_text.split("\n\n"), collection_name=self.collection_name)
+        self.index = SchemaIndex(self.schema, self.collection)
+
+    def load_agent(self):
+        # the agent's SQL tool is bound to this tenant's database
+        self.agent = build_agent(with_memory=False, connection_string=self.connection_string)
+
+    def load(self):
+        # synchronous load for scripts; servers go through self.warmup
+        for _, step in self.warmup.steps:
+            step()
+        return self
+
+    def reload(self):
+        stale = self.fingerprint
+        reload_engine(self.connection_string)
+        result_cache.clear(self.connection_string)
+        self.load_schema()
+        # cached SQL written against the old schema is no longer trustworthy
+        if stale != self.fingerprint:
+            question_cache.invalidate(drop_fingerprint=stale)
+        self.load_schema_store()
+
+    def session(self, session_id):
+        # sessions are per database: the same id against another database starts fresh
+        return session_store.get(f"{self.name}:{session_id}") if session_id else None
+
+    def close(self):
+        dispose_engine(self.connection_string)
+        result_cache.clear(self.connection_string)
+
+
+class TenantRegistry:
+    def __init__(self, databases, factory=Tenant, max_loaded=TENANT_MAX_LOADED):
+        # factory(name, connection_string) -> tenant object with .active, .last_used and close()
+        self.databases = dict(databases)
+        self.factory = factory
+        self.max_loaded = max(1, max_loaded)
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def url(self, name=None):
+        name = name or DEFAULT_TENANT
+        try:
+            return self.databases[name]
+        except KeyError:
+            raise UnknownTenantError(name) from None
+
+    def _acquire(self, name, pin):
+        name = name or DEFAULT_TENANT
+        url = self.url(name)
+        with self._lock:
+            tenant = self._loaded.get(name)
+            if tenant is None:
+                tenant = self._loaded[name] = self.factory(name, url)
+                self.loads += 1
+            self._loaded.move_to_end(name)
+            tenant.last_used = time.monotonic()
+            tenant.active += pin
+            evicted = self._evict()
+        for old in evicted:
+            old.close()
+        return tenant
+
+    def _evict(self):
+        # least recently used first, skipping tenants that are serving a request;
+        # if every one of them is busy we run over the limit until one is released
+        evicted = []
+        for name in list(self._loaded):
+            if len(self._loaded) <= self.max_loaded:
+                break
+            if self._loaded[name].active == 0:
+                evicted.append(self._loaded.pop(name))
+                self.evictions += 1
+        return evicted
+
+    def peek(self, name=None):
+        """The loaded tenant for `name`, or None; unlike get() it never loads or evicts anything."""
+        self.url(name)
+        with self._lock:
+            return self._loaded.get(name or DEFAULT_TENANT)
+
+    def get(self, name=None):
+        """The tenant for `name` (default tenant if empty), created on first use."""
+        return self._acquire(name, 0)
+
+    @contextmanager
+    def use(self, name=None):
+        # pins the tenant so it is not evicted while the request is using it
+        tenant = self._acquire(name, 1)
+        try:
+            yield tenant
+        finally:
+            with self._lock:
+                tenant.active -= 1
+                tenant.last_used = time.monotonic()
+                evicted = self._evict()
+            for old in evicted:
+                old.close()
+
+    def loaded(self):
+        with self._lock:
+            return list(self._loaded.values())
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            report = {
+                "configured": len(self.databases),
+                "loaded": len(self._loaded),
+                "max_loaded": self.max_loaded,
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
+            for name, tenant in self._loaded.items():
+                report[name] = {"active": tenant.active, "idle_seconds": now - tenant.last_used}
+            return report
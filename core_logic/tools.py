@@ -1,10 +1,20 @@
-from langchain_core.tools import tool
+from langchain_core.tools import tool, StructuredTool
 import os
+import re
 from dotenv import load_dotenv
-import google.generativeai as genai
+from db_engine import connect
+from query_guard import guard_sql, statement_timeout, strip_comments, QUERY_TIMEOUT_SECONDS
+from result_cache import result_cache
+from llm_gateway import gateway
+import metrics
 
 load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API"))
+
+# rows shown to the agent; the full result is only available through iter_rows
+RESULT_PREVIEW_ROWS = int(os.getenv("RESULT_PREVIEW_ROWS", "20"))
+# hard cap on rows counted for the agent and on one page of streamed results
+RESULT_ROW_CAP = int(os.getenv("RESULT_ROW_CAP", "10000"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
 
 @tool
 def generate_sql_tool(question, schema_context):
@@ -18,8 +28,6 @@ def generate_sql_tool(question, schema_context):
     Returns:
         str: The generated SQL query in English.
     """
-    from google.generativeai import GenerativeModel
-    model = GenerativeModel("gemini-2.0-flash")
     prompt = f"""
     You are a highly skilled SQL expert who understands multiple languages, including Indian languages such as Hindi, Tamil, Bengali, Marathi, etc.
 
@@ -39,8 +47,102 @@ def generate_sql_tool(question, schema_context):
 
     Output only the SQL.
     """
-    response = model.generate_content(prompt)
-    return response.text.strip()
+    return gateway.invoke(prompt).strip()
+
+
+def has_order_by(sql):
+    """True if the statement itself (not a subquery, literal or comment) has an ORDER BY."""
+    flat = re.sub(r"'(?:[^']|'')*'|\"[^\"]*\"|`[^`]*`", "''", strip_comments(sql))
+    depth = 0
+    top_level = []
+    for ch in flat:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0:
+            top_level.append(ch)
+            continue
+        top_level.append(" ")
+    return re.search(r"\bORDER\s+BY\b", "".join(top_level), re.IGNORECASE) is not None
+
+def iter_rows(connection_string, sql, offset=0, limit=None, timeout=QUERY_TIMEOUT_SECONDS):
+    """
+    Stream the rows of a query with a server-side cursor, one tuple at a time.
+
+    The first item yielded is the list of column names. With a limit the query
+    is wrapped in LIMIT/OFFSET so the database does the paging; a query without
+    its own ORDER BY is sorted by every column so that consecutive pages never
+    skip or repeat rows. The query is cancelled with QueryTimeoutError once it
+    runs longer than `timeout` seconds.
+    """
+    from sqlalchemy import text
+    sql = strip_comments(sql).strip().rstrip(";")
+    params = {}
+    with connect(connection_string) as conn, statement_timeout(conn, timeout):
+        if limit is not None:
+            order = ""
+            if not has_order_by(sql):
+                # an unordered "LIMIT n [OFFSET m]" (e.g. from the cost guard) picks arbitrary
+                # rows; apply it after the sort below instead, as a window over the sorted rows
+                trailing = re.search(r"\s+LIMIT\s+(\d+)(?:\s+OFFSET\s+(\d+))?\s*$", sql, re.IGNORECASE)
+                if trailing:
+                    sql = sql[:trailing.start()]
+                    cap = int(trailing.group(1))
+                    limit = max(0, min(limit, cap - offset))
+                    offset += int(trailing.group(2) or 0)
+                # LIMIT 0 only plans the query; we need the column count for ORDER BY 1, 2, ...
+                width = len(conn.execute(text(f"SELECT * FROM ({sql}) AS paged_result LIMIT 0")).keys())
+                order = " ORDER BY " + ", ".join(str(i) for i in range(1, width + 1))
+            sql = f"SELECT * FROM ({sql}) AS paged_result{order} LIMIT :_limit OFFSET :_offset"
+            params = {"_limit": limit, "_offset": offset}
+        result = conn.execution_options(yield_per=STREAM_BATCH_SIZE).execute(text(sql), params)
+        yield list(result.keys())
+        for row in result:
+            yield tuple(row)
+
+def preview_sql(connection_string, sql, preview_rows=RESULT_PREVIEW_ROWS, row_cap=RESULT_ROW_CAP):
+    # first few rows plus a row count, without ever holding the full result in memory;
+    # repeats of the same query against unchanged data are served from result_cache
+    variant = (preview_rows, row_cap)
+    cached = result_cache.get(connection_string, sql, variant)
+    metrics.incr("result_cache_lookups", result="hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached
+    version = result_cache.data_version(connection_string)
+    rows = iter_rows(connection_string, sql)
+    columns = next(rows)
+    preview = []
+    row_count = 0
+    for row in rows:
+        if row_count < preview_rows:
+            preview.append(row)
+        row_count += 1
+        if row_count >= row_cap:
+            break
+    rows.close()
+    result = {
+        "columns": columns,
+        "rows": preview,
+        "row_count": row_count,
+        "truncated": row_count > len(preview),
+        "capped": row_count >= row_cap
+    }
+    result_cache.put(connection_string, sql, result, version, variant)
+    return result
+
+def run_sql(connection_string, sql):
+    print("📌 execute_sql_tool called with SQL:", sql)
+    result = preview_sql(connection_string, sql)
+    if result["rows"]:
+        readable_rows = [", ".join(str(item) for item in row) for row in result["rows"]]
+        response = f"I found the following results:\n" + "\n".join(readable_rows)
+        if result["truncated"]:
+            total = f"at least {result['row_count']}" if result["capped"] else str(result["row_count"])
+            response += f"\n... showing {len(result['rows'])} of {total} rows."
+    else:
+        response = "No results found."
+    return response
 
 
 @tool
@@ -53,18 +155,30 @@ def execute_sql_tool(connection_string, sql):
         sql (str): The SQL query to execute.
 
     Returns:
-        str: Human-readable results or a message if no rows are found.
+        str: Human-readable preview of the first rows plus the total row count,
+        or a message if no rows are found.
     """
-    print("📌 execute_sql_tool called with SQL:", sql)
-    from sqlalchemy import create_engine, text
-    engine = create_engine(connection_string)
-    with engine.connect() as conn:
-        result = conn.execute(text(sql))
-        rows = result.fetchall()
-        columns = result.keys()
-        if rows:
-            readable_rows = [", ".join(str(item) for item in row) for row in rows]
-            response = f"I found the following results:\n" + "\n".join(readable_rows)
-        else:
-            response = "No results found."
-    return response
+    return guarded_run_sql(connection_string, sql)
+
+def guarded_run_sql(connection_string, sql):
+    guard = guard_sql(connection_string, sql)
+    if guard["action"] == "rejected":
+        # tell the agent why, so it can add filters or a join condition and retry
+        return "Query rejected by the cost guard: " + "; ".join(guard["reasons"])
+    return run_sql(connection_string, guard["sql"])
+
+def bind_sql_tool(connection_string):
+    """execute_sql_tool with the database fixed: the model supplies only the SQL, never a URL."""
+    def execute_sql_tool(sql: str) -> str:
+        """
+        Execute a given SQL query on the connected database and return the results.
+
+        Args:
+            sql (str): The SQL query to execute.
+
+        Returns:
+            str: Human-readable preview of the first rows plus the total row count,
+            or a message if no rows are found.
+        """
+        return guarded_run_sql(connection_string, sql)
+    return StructuredTool.from_function(execute_sql_tool)
@@ -1,29 +1,57 @@
-import chromadb
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from dotenv import load_dotenv
+from embeddings import get_embedder
+import hashlib
 import os
 
 load_dotenv()
-google_api_key = os.getenv("GOOGLE_API")
 
-EMBED_MODEL = GoogleGenerativeAIEmbeddings(
-    model="models/embedding-001",
-    google_api_key=google_api_key
-)
+# max number of chunks sent to the embedding API in one request
+EMBED_BATCH_SIZE = int(os.getenv("SCHEMA_EMBED_BATCH_SIZE", "100"))
 
-def create_schema_store(schema_text_chunks, persist_dir="schema_db"):
+def chunk_id(text):
+    # content-addressed id: an unchanged table keeps the same id across reloads
+    return "chunk_" + hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+def create_schema_store(schema_text_chunks, persist_dir="schema_db", batch_size=EMBED_BATCH_SIZE,
+                        collection_name="schema_memory"):
+    # collection_name: one collection per database (see tenants.collection_name); stale
+    # chunks are deleted below, so two databases must never share a collection
+    import chromadb  # slow import; only paid by the warm-up, not at server start
     client = chromadb.PersistentClient(path=persist_dir)
-    collection = client.get_or_create_collection(name="schema_memory")
-    for i, text in enumerate(schema_text_chunks):
-        embedding = EMBED_MODEL.embed_query(text)
-        collection.add(
-            ids=[f"chunk_{i}"],
-            embeddings=[embedding],
-            documents=[text]
+    collection = client.get_or_create_collection(name=collection_name)
+
+    wanted = {}
+    for text in schema_text_chunks:
+        if text.strip():
+            wanted.setdefault(chunk_id(text), text)
+
+    existing = set(collection.get(include=[])["ids"])
+    stale = [doc_id for doc_id in existing if doc_id not in wanted]
+    if stale:
+        collection.delete(ids=stale)
+
+    # only chunks we have never embedded cost an API call
+    new_ids = [doc_id for doc_id in wanted if doc_id not in existing]
+    if not new_ids:
+        return collection
+
+    documents = [wanted[doc_id] for doc_id in new_ids]
+    embeddings = []
+    for start in range(0, len(documents), batch_size):
+        embeddings.extend(get_embedder().embed_documents(documents[start:start + batch_size]))
+
+    # chroma caps how many records one call may carry; normally this is a single upsert
+    max_batch = client.get_max_batch_size()
+    for start in range(0, len(new_ids), max_batch):
+        end = start + max_batch
+        collection.upsert(
+            ids=new_ids[start:end],
+            embeddings=embeddings[start:end],
+            documents=documents[start:end]
         )
     return collection
 
 def query_schema_store(collection, question, k=3):
-    query_embedding = EMBED_MODEL.embed_query(question)
+    query_embedding = get_embedder().embed_query(question)
     results = collection.query(query_embeddings=[query_embedding], n_results=k)
     return [doc for doc in results["documents"][0]]
@@ -0,0 +1,63 @@
+# warmup.py
+# Runs the expensive start-up steps (schema extraction, embedding, agent
+# construction, ...) on a background thread when the server starts, and
+# reports their progress for the readiness endpoint.
+import threading
+import time
+
+
+class Warmup:
+    def __init__(self, steps):
+        # steps: [(name, fn)] executed in order
+        self.steps = steps
+        self.progress = {name: {"status": "pending"} for name, _ in steps}
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            # a failed warm-up is retried by the next start()/wait()
+            retry = self._thread is not None and self.error is not None and not self._thread.is_alive()
+            if self._thread is None or retry:
+                self.error = None
+                self.started_at = time.time()
+                self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        for name, fn in self.steps:
+            self.progress[name] = {"status": "running"}
+            start = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                self.progress[name] = {"status": "failed", "error": str(e)}
+                self.error = f"{name}: {e}"
+                self.finished_at = time.time()
+                return
+            self.progress[name] = {"status": "done", "seconds": time.perf_counter() - start}
+        self.finished_at = time.time()
+        self._ready.set()
+
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        # starts the warm-up if nobody did, e.g. when the app runs without a server hook
+        self.start()
+        return self._ready.wait(timeout)
+
+    def status(self):
+        done = sum(1 for p in self.progress.values() if p["status"] == "done")
+        return {
+            "ready": self.ready(),
+            "failed": self.error is not None,
+            "error": self.error,
+            "progress": f"{done}/{len(self.steps)}",
+            "steps": dict(self.progress)
+        }
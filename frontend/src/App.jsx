@@ -8,6 +8,8 @@ const App = () => {
   const [responseData, setResponseData] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  // one conversation per page load so the backend can keep follow-up context
+  const [sessionId] = useState(() => crypto.randomUUID());
 
   const handleInputChange = (e) => {
     setInputValue(e.target.value);
@@ -27,7 +29,7 @@ const App = () => {
         headers: {
           "Content-Type": "application/json",
         },
-        body: JSON.stringify({ question: inputValue }),
+        body: JSON.stringify({ question: inputValue, session_id: sessionId }),
       });
 
       if (!res.ok) throw new Error(`Server error: ${res.status}`);